@@ -3,19 +3,19 @@
 # You can also customize the list of files to delete.
 # Use 'UCT.py -h' in cmd for available commands.
 
-import argparse
-from argparse import RawTextHelpFormatter
-import subprocess
-import shutil
+# Only modules needed by every run are imported here. The heavy ones (tkinter, argparse,
+# subprocess, winreg, concurrent.futures) are imported where they are used, so that a
+# plain double click clean starts about as fast as the interpreter itself.
 import json
-import glob
+import threading
+import time
 import sys
 import os
+import stat
+import copy
 from os.path import exists
-import tkinter as tk
-import tkinter.messagebox
-import tkinter.filedialog
-import winreg
+from contextlib import contextmanager, nullcontext
+from collections import deque
 
 defaultFolders = ['.vs', 'Binaries', 'DerivedDataCache', 'Intermediate']
 defaultExtensions = ['.sln']
@@ -24,17 +24,86 @@ defaultConfig = {
     {
         'files':[],
         'folders':defaultFolders,
-        'extensions':defaultExtensions
+        'extensions':defaultExtensions,
+        # Platform/Target/Configuration, narrows the Intermediate rule down to these build folders
+        'scopes':[]
     },
     'settings':
     {
         'generateProjectFiles':False,
         'compile':False,
-        'disableCompileMessage':False
+        'disableCompileMessage':False,
+        'deleteWorkers':0,
+        'deleteRate':0,       # Files per second, 0 = no limit
+        'deleteBandwidth':0,  # Bytes per second, 0 = no limit
+        'largestFirst':False,
+        'instantClean':False,
+        'ddcBudget':0,  # Bytes, 0 = no budget
+        'ddcMaxAge':0,  # Days, 0 = no limit
+        'buildLog':'',  # File to save build output to, empty = off
+        'cleanPlugins':True,
+        # Configuration|Platform pairs built by compile
+        'buildMatrix':['Development Editor|Win64'],
+        'buildJobs':0,  # Builds at the same time, 0 = automatic
+        # Watch mode cleans the project when one of these goes over, bytes, 0 = no limit
+        'watchLimits':{'Intermediate':0, 'DerivedDataCache':0, 'total':0}
+    },
+    # Folder -> what to keep of it. Items are the files in it, or the folders directly in it.
+    # keep = newest items kept (0 = all), maxAge = days, maxSize = bytes (0 = no limit), compress = gzip all but the newest log
+    'retention':
+    {
+        'Saved/Logs':{'items':'files', 'keep':0, 'maxAge':0, 'maxSize':0, 'compress':False},
+        'Saved/Crashes':{'items':'folders', 'keep':0, 'maxAge':0, 'maxSize':0, 'compress':False},
+        'Saved/Autosaves':{'items':'files', 'keep':0, 'maxAge':0, 'maxSize':0, 'compress':False}
     }
 }
 config = {}
 
+# Architecture folders UE5 puts between the platform and target folders in Intermediate/Build
+buildArchitectures = {'x64', 'x86', 'arm64', 'arm64ec', 'x86_64-unknown-linux-gnu', 'aarch64-unknown-linux-gnueabi'}
+
+# Instant clean moves folders in here, they are then deleted in the background
+stagingFolderName = '.uct_staging'
+
+# Build output is streamed, these bound how much of it is kept in memory and on disk
+maxBuildErrors = 100
+buildLogMaxBytes = 10 * 1024 * 1024
+buildLogBackups = 3
+
+# Every build already uses several cores and a lot of memory, this is what one build is given
+buildCoresPerJob = 4
+buildMemoryPerJob = 8 * 1024 ** 3
+
+# Trimmed instead of deleted when a budget or max age is set
+derivedDataCacheFolder = 'DerivedDataCache'
+
+# What generating project files writes to, these are deleted before it runs. The rest is deleted alongside it
+projectFileOutputs = {'Intermediate', '.vs'}
+projectFileExtensions = ('.sln',)
+
+# Stashed folders are archived in here, so they can be restored instead of rebuilt
+stashFolderName = '.uct_stash'
+stashFolders = ['DerivedDataCache', 'Binaries']
+stashMagic = b'UCTSTASH\x01'
+stashChunkSize = 4 * 1024 * 1024
+# Fast, most of the cache is compressed already
+stashLevel = 1
+
+# Identical DerivedDataCache files across projects are hardlinked to one copy in this store
+dedupeStoreName = '.uct_ddc_store'
+dedupeCacheFileName = 'hashes.json'
+# Small files save little and cost a link each
+dedupeMinSize = 64 * 1024
+dedupeBlockSize = 1024 * 1024
+
+# Watch mode checks every interval, and slows down if checking takes more than this part of the time
+watchInterval = 60
+watchDutyCycle = 0.01
+watchReportSeconds = 3600
+
+# Folders the delete walk never looks inside, nothing in them is temporary
+walkSkipFolders = {'.git', '.svn', 'Content', 'ThirdParty', stagingFolderName, stashFolderName, dedupeStoreName}
+
 # JSON data in uproject file
 uprojectData = {}
 
@@ -42,19 +111,89 @@ uprojectData = {}
 # so that we don't have to search for it every time
 defaultAppdataSavedVars = {
     'ubtPath':None,
-    'devenvPath':None
+    'devenvPath':None,
+    # Install root -> {'association': engine version or 'VisualStudio', 'tools': {name: {'path'}}}
+    'toolIndex':{}
 }
 appdataSavedVars = {}
-appdataSavedVarsPath = os.environ['LOCALAPPDATA']
+# Only Windows has LOCALAPPDATA, elsewhere the usual place for per-user data is used
+appdataSavedVarsPath = os.environ.get('LOCALAPPDATA', os.path.join(os.path.expanduser('~'), '.local', 'share'))
 
 # Current file path
 path = os.path.dirname(os.path.abspath(__file__))
 
+# Local configuration file, next to the uproject file
+configFileName = 'uct_config.json'
+
+# Planned and finished deletes, so an interrupted clean can pick up where it stopped
+journalFileName = 'uct_journal.jsonl'
+journal = None
+
+# Seconds to wait before each retry of files that were locked
+deleteRetryDelays = (0.1, 0.5, 2.0)
+
+# Parsed .uplugin files, so unchanged descriptors aren't read again
+pluginCacheFileName = 'uct_plugins.json'
+
+# Folder rules that are also applied inside each plugin
+pluginFolderNames = ['Binaries', 'Intermediate']
+
+# Folders in Plugins that never contain plugins
+pluginSkipFolders = {'Binaries', 'Intermediate', 'Content', 'Source', 'Resources', 'Config', 'Shaders', 'ThirdParty'}
+
+# Sizes of every folder in the project, so -show doesn't have to walk it every time.
+# Kept in localappdata, writing it inside the project would change the modify time of the folder it indexes
+sizeIndexFolderName = 'sizes'
+sizeIndexLock = threading.Lock()
+
+# Deletes can be rate limited, so they don't take all disk time from builds running next to them.
+# The limit is scaled down when deletes get slower than usual, which means something else is using the disk
+throttle = None
+throttleLock = threading.Lock()
+# Seconds of the rate that can be used at once
+throttleBurst = 0.1
+# Seconds of deletes that are averaged before the limit is adjusted
+throttleWindow = 0.25
+throttleSlowdown = 3.0
+throttleMinScale = 0.05
+
+# Contents of each JSON file as it was read or last written, so unchanged files aren't written again
+savedFiles = {}
+
 # Unreal project name (.uproject)
 uprojectPath = None
 
+# Where the tools usually are, relative to the install root. Checked before searching
+knownToolLocations = {
+    'UnrealBuildTool.exe': [
+        os.path.join("Engine", "Binaries", "DotNET", "UnrealBuildTool", "UnrealBuildTool.exe"), # UE5
+        os.path.join("Engine", "Binaries", "DotNET", "UnrealBuildTool.exe")                     # UE4
+    ],
+    'devenv.exe': [
+        os.path.join("Common7", "IDE", "devenv.exe")
+    ]
+}
+
+# Folders in engine, project and visual studio trees that never contain the files we search for
+searchSkipFolders = {'.git', '.vs', 'Content', 'Source', 'Intermediate', 'DerivedDataCache', 'Saved', 'Plugins',
+                     'Shaders', 'Documentation', 'Samples', 'Templates', 'FeaturePacks', 'ThirdParty'}
+searchMaxDepth = 8
+visualStudioRoot = r"C:\Program Files\Microsoft Visual Studio"
+
+# Set when running without a user (batch mode), prompts are printed instead of shown
+headless = False
+
+# Timings of each phase and rule, for the trace report and the run history. None in batch workers
+tracer = None
+
+# Folders that batch mode does not search for projects in
+batchSkipFolders = {'Binaries', 'Intermediate', 'DerivedDataCache', 'Saved', 'Content', 'Source', 'Plugins', 'Engine', 'Templates'}
+
 
 def initArgs():
+    import argparse
+    from argparse import RawTextHelpFormatter
+
     # Program description
     parser = argparse.ArgumentParser(usage=argparse.SUPPRESS, description = '''
     ### Unreal Cleanup Tool ###\n\n
@@ -70,9 +209,38 @@ def initArgs():
     parser.add_argument('-rf', help='Remove a folder from delete list', type=str, metavar='[foldername]')
     parser.add_argument('-ae', help='Add a file extension to the delete list', type=str, metavar='[ext]')
     parser.add_argument('-re', help='Remove a file extension from the delete list', type=str, metavar='[ext]')
+    parser.add_argument('-as', dest='addScope', help='Only delete these build folders in Intermediate, e.g. Win64/UnrealEditor/Development (* matches anything)', type=str, metavar='[platform/target/configuration]')
+    parser.add_argument('-rs', help='Remove a build folder scope', type=str, metavar='[platform/target/configuration]')
     parser.add_argument('-gpf', help="Toggle automatic generation of VS project files after deletion", action='store_true')
     parser.add_argument('-compile', help="Toggle automatic compilation of project after deletion", action='store_true')
+    parser.add_argument('-ddcbudget', help='Trim DerivedDataCache to this size instead of deleting it, least recently used first (0 = off)', type=str, metavar='[size, e.g. 20G]')
+    parser.add_argument('-ddcage', help='Trim DerivedDataCache entries not used in this many days instead of deleting it (0 = off)', type=int, metavar='[days]')
+    parser.add_argument('-watchlimit', help='Set the size that makes watch mode clean the project (total is the whole project folder, 0 = no limit)', type=str, nargs=2, metavar=('[Intermediate|DerivedDataCache|total]', '[size]'))
+    parser.add_argument('-instant', help="Toggle instant clean: move folders aside and delete them in the background", action='store_true')
+    parser.add_argument('-buildlog', help="Save output of project generation and compilation to a rotating log file (no file = off)", type=str, nargs='?', const='', metavar='[file]')
+    parser.add_argument('-plugins', help="Toggle cleaning Binaries and Intermediate inside each project plugin", action='store_true')
+    parser.add_argument('-ab', help='Add a configuration to build after compiling is enabled', type=str, metavar='"[configuration]|[platform]"')
+    parser.add_argument('-rb', help='Remove a configuration from the builds', type=str, metavar='"[configuration]|[platform]"')
+    parser.add_argument('-buildjobs', help='Set how many configurations are built at the same time (0 = automatic)', type=int, metavar='[count]')
+    parser.add_argument('-retain', help='Set what to keep of a folder, e.g. -retain Saved/Logs keep=20 age=14 size=1G gzip=on (0 or off = no limit, off alone turns it off)', type=str, nargs='+', metavar='[folder] [option=value]')
     parser.add_argument('-msg', help="Toggle the popup message when the project was succesfully compiled", action='store_true')
+    parser.add_argument('-deleterate', help='Limit deleting to this many files per second, it is lowered when the disk is busy (0 = no limit)', type=int, metavar='[files]')
+    parser.add_argument('-deletebandwidth', help='Limit deleting to this many bytes per second, it is lowered when the disk is busy (0 = no limit)', type=str, metavar='[size, e.g. 100M]')
+    parser.add_argument('-largest', help='Toggle deleting the largest folders first, so the most space is freed early', action='store_true')
+    parser.add_argument('-workers', help='Set the number of threads used for deleting (0 = automatic)', type=int, metavar='[count]')
+    parser.add_argument('-plan', help='Show what would be deleted without deleting, optionally save it to a manifest file', type=str, nargs='?', const='', metavar='[manifest]')
+    parser.add_argument('-execute', help='Delete exactly what a saved plan manifest lists', type=str, metavar='[manifest]')
+    parser.add_argument('-stash', help='Archive DerivedDataCache and Binaries, then delete them', type=str, nargs='?', const='', metavar='[name]')
+    parser.add_argument('-restore', help='Restore a stash, the latest one if no name is given', type=str, nargs='?', const='', metavar='[name]')
+    parser.add_argument('-batch', help='Clean every unreal project found under a folder', type=str, metavar='[folder]')
+    parser.add_argument('-dedupe', help='Hardlink identical DerivedDataCache files of every project under a folder', type=str, nargs='?', const='.', metavar='[folder]')
+    parser.add_argument('-watch', help='Keep checking the projects under a folder and clean them when they go over their watch limits', type=str, nargs='?', const='.', metavar='[folder]')
+    parser.add_argument('-interval', help='Seconds between checks in watch mode', type=int, metavar='[seconds]')
+    parser.add_argument('-jobs', help='Number of projects to clean at the same time in batch mode', type=int, metavar='[count]')
+    parser.add_argument('-trace', help='Clean the project and print how long each phase and rule took', action='store_true')
+    parser.add_argument('-tracefile', help='Like -trace, and save a Chrome trace (chrome://tracing) to a file', type=str, metavar='[file]')
+    parser.add_argument('-profile', help='Like -trace, and save a cProfile dump to a file', type=str, metavar='[file]')
+    parser.add_argument('-history', help='Show recent runs, time trends and what each rule costs in rebuild time', type=int, nargs='?', const=10, metavar='[runs]')
     parser.add_argument('-show', help='Show the current file/folder delete configuration', action='store_true')
     parser.add_argument('-reset', help='Reset delete list to default', action='store_true')
 
@@ -80,6 +248,9 @@ def initArgs():
     parser.add_argument('-uedir', help=argparse.SUPPRESS, action='store_true')
     parser.add_argument('-vsdir', help=argparse.SUPPRESS, action='store_true')
 
+    # Used by the background process that empties the staging folder
+    parser.add_argument('-reap', help=argparse.SUPPRESS, action='store_true')
+
     # Check user's arguments and add them to array
     return parser.parse_args()
 
@@ -87,27 +258,46 @@ def initArgs():
 def askWarningPrompt(message):
     "Prompt the user for a yes/no answer"
 
+    # Nobody to answer, assume no
+    if headless:
+        print(f'Warning: {message}')
+        return False
+
     # Show popup
-    answer = tk.messagebox.askokcancel("Unreal Cleanup Tool", message, icon=tk.messagebox.WARNING)
+    import tkinter.messagebox
+    answer = tkinter.messagebox.askokcancel("Unreal Cleanup Tool", message, icon=tkinter.messagebox.WARNING)
     return answer
 
 
 def infoPrompt(message):
     "Show a message prompt"
 
+    if headless:
+        print(message)
+        return
+
     # Show popup
-    tk.messagebox.showinfo("Unreal Cleanup Tool", message)
+    import tkinter.messagebox
+    tkinter.messagebox.showinfo("Unreal Cleanup Tool", message)
 
 def errorPrompt(message):
     "Show an error prompt"
 
+    if headless:
+        print(f'Error: {message}')
+        return
+
     # Show popup
-    tk.messagebox.showerror("Unreal Cleanup Tool", message)
+    import tkinter.messagebox
+    tkinter.messagebox.showerror("Unreal Cleanup Tool", message)
 
 
 def folderPrompt():
     "Prompt the user to select a folder"
 
+    import tkinter as tk
+    import tkinter.filedialog
+
     # Open a new tkinter main window
     root = tk.Tk()
     root.title('Main')
@@ -139,10 +329,56 @@ def processArgs(args):
     global config
     localconfig = config['fileManagement']
 
+    # Empty the staging folder, this runs in the background so don't touch the config
+    if args.reap:
+        reapStaging()
+        return
+
+    # Dry run
+    if args.plan is not None:
+        with phase('plan'):
+            plan(args.plan)
+        return
+
+    # Run a saved plan
+    if args.execute is not None:
+        try:
+            runClean(readManifest(args.execute))
+        except (OSError, ValueError) as e:
+            print(f'Could not run plan: {e}')
+        return
+
+    if args.history is not None:
+        showHistory(args.history)
+        return
+
+    # Archive and delete, or bring back, the slow to rebuild folders
+    if args.stash is not None or args.restore is not None:
+        if uprojectPath is None:
+            print("Stashing only works in an unreal engine project folder.")
+        elif args.stash is not None:
+            stash(args.stash)
+        else:
+            restore(args.restore)
+        return
+
+    # Clean many projects, this doesn't change the config
+    if args.batch is not None:
+        runBatch(args.batch, args.jobs)
+        return
+
+    if args.dedupe is not None:
+        dedupe(args.dedupe)
+        return
+
+    if args.watch is not None:
+        watch(args.watch, args.interval)
+        return
+
     # Reset list
     if args.reset is not None:
         if args.reset:
-            config = defaultConfig
+            config = copy.deepcopy(defaultConfig)
             print("List reset to default.")
             saveData()
             return
@@ -236,6 +472,28 @@ def processArgs(args):
         except ValueError:
             print(f"'{mod}' does not exists in the list!'")
 
+    # Add scope
+    if args.addScope is not None:
+        scope = parseScope(args.addScope)
+        if scope is None:
+            print(f"'{args.addScope}' is not a valid scope. Use platform/target/configuration, e.g. Win64/UnrealEditor/Development.")
+        elif scope in localconfig['scopes']:
+            print(f'{scope} is already in the list.')
+        else:
+            localconfig['scopes'].append(scope)
+            print(f'Added scope {scope}')
+            if 'Intermediate' not in localconfig['folders']:
+                print("Scopes only apply when Intermediate is in the folder list. Use -af Intermediate to add it.")
+
+    # Remove scope
+    if args.rs is not None:
+        scope = parseScope(args.rs)
+        if scope in localconfig['scopes']:
+            localconfig['scopes'].remove(scope)
+            print(f'Removed scope {scope}')
+        else:
+            print(f"'{args.rs}' does not exists in the list!'")
+
     # Toggle generate project files
     if args.gpf:
         if config['settings']['generateProjectFiles'] == False: # Enable
@@ -261,35 +519,185 @@ def processArgs(args):
             config['settings']['compile'] = False
         print(f"Automatic compilation set to {config['settings']['compile']}")
 
+    if args.instant:
+        config['settings']['instantClean'] = not config['settings']['instantClean']
+        print(f"Instant clean set to {config['settings']['instantClean']}")
+
+    if args.plugins:
+        config['settings']['cleanPlugins'] = not config['settings']['cleanPlugins']
+        print(f"Plugin cleaning set to {config['settings']['cleanPlugins']}")
+
+    if args.buildlog is not None:
+        config['settings']['buildLog'] = os.path.abspath(args.buildlog) if args.buildlog else ''
+        print(f"Build log set to {config['settings']['buildLog'] or 'off'}")
+
+    # Retention
+    if args.retain is not None:
+        setRetention(args.retain[0], args.retain[1:])
+
+    # Build matrix
+    if args.ab is not None:
+        build = parseBuild(args.ab)
+        if build is None:
+            print(f"'{args.ab}' is not a valid build. Use configuration|platform, e.g. \"Development Editor|Win64\".")
+        elif build in config['settings']['buildMatrix']:
+            print(f'{build} is already in the list.')
+        else:
+            config['settings']['buildMatrix'].append(build)
+            print(f'Added build {build}')
+
+    if args.rb is not None:
+        build = parseBuild(args.rb)
+        if build in config['settings']['buildMatrix']:
+            config['settings']['buildMatrix'].remove(build)
+            print(f'Removed build {build}')
+        else:
+            print(f"'{args.rb}' does not exists in the list!'")
+
+    if args.buildjobs is not None:
+        if args.buildjobs >= 0:
+            config['settings']['buildJobs'] = args.buildjobs
+            print(f"Builds at the same time set to {args.buildjobs if args.buildjobs else 'automatic'}")
+        else:
+            print("The number of builds can not be negative.")
+
     if args.msg:
         config['settings']['disableCompileMessage'] = not config['settings']['disableCompileMessage']
         print(f"Compile success popup message {'turned off' if config['settings']['disableCompileMessage'] else 'turned on'}.")
 
+    # DerivedDataCache trimming
+    if args.ddcbudget is not None:
+        try:
+            config['settings']['ddcBudget'] = parseSize(args.ddcbudget)
+            print(f"DerivedDataCache budget set to {formatSize(config['settings']['ddcBudget']) if config['settings']['ddcBudget'] else 'off'}")
+        except ValueError:
+            print(f"'{args.ddcbudget}' is not a valid size. Use a number with an optional K, M, G or T suffix.")
+
+    if args.ddcage is not None:
+        if args.ddcage >= 0:
+            config['settings']['ddcMaxAge'] = args.ddcage
+            print(f"DerivedDataCache max age set to {str(args.ddcage) + ' days' if args.ddcage else 'off'}")
+        else:
+            print("The max age can not be negative.")
+
+    if args.watchlimit is not None:
+        name, size = args.watchlimit
+        limits = config['settings']['watchLimits']
+        key = next((key for key in limits if key.lower() == name.lower()), None)
+        if key is None:
+            print(f"'{name}' can not be watched. Use {', '.join(limits)}.")
+        else:
+            try:
+                limits[key] = parseSize(size)
+                print(f"Watch limit for {key} set to {formatSize(limits[key]) if limits[key] else 'off'}")
+            except ValueError:
+                print(f"'{size}' is not a valid size. Use a number with an optional K, M, G or T suffix.")
+
+    # Delete rate limits
+    if args.deleterate is not None:
+        if args.deleterate >= 0:
+            config['settings']['deleteRate'] = args.deleterate
+            print(f"Delete rate limit set to {str(args.deleterate) + ' files/s' if args.deleterate else 'off'}")
+        else:
+            print("The delete rate can not be negative.")
+
+    if args.deletebandwidth is not None:
+        try:
+            config['settings']['deleteBandwidth'] = parseSize(args.deletebandwidth)
+            print(f"Delete bandwidth limit set to {formatSize(config['settings']['deleteBandwidth']) + '/s' if config['settings']['deleteBandwidth'] else 'off'}")
+        except ValueError:
+            print(f"'{args.deletebandwidth}' is not a valid size. Use a number with an optional K, M, G or T suffix.")
+
+    if args.largest:
+        config['settings']['largestFirst'] = not config['settings']['largestFirst']
+        print(f"Largest first set to {config['settings']['largestFirst']}")
+
+    # Set number of delete threads
+    if args.workers is not None:
+        if args.workers >= 0:
+            config['settings']['deleteWorkers'] = args.workers
+            print(f"Delete threads set to {getDeleteWorkers()}{' (automatic)' if args.workers == 0 else ''}")
+        else:
+            print("The number of delete threads can not be negative.")
+
     # Show delete list
     if args.show:
         indent = "    "
+        # How much each rule would free, only in a project
+        sizes = None
+        if uprojectPath is not None:
+            start = time.perf_counter()
+            matcher = compileRules(localconfig)
+            index, scanned = updateSizeIndex()
+            sizes = reclaimable(index, matcher, pluginFolders())
+            unknown = matcher['globs']['files'][1] if matcher['globs']['files'] else []
+            seconds = time.perf_counter() - start
+
         # Don't print disabled default arguments (marked with '/')
         for key in localconfig:
             print(f'{key.capitalize()}:')
             valueCount = 0
             for value in localconfig[key]:
                 if value[0] != '/':
-                    print(indent + value)
+                    if sizes is None:
+                        print(indent + value)
+                    else:
+                        if key == 'files' and value in unknown:
+                            size = '?'
+                        elif key == 'folders' and value == 'Intermediate' and matcher['scopes']:
+                            size = 'by scope'
+                        else:
+                            size = formatSize(sizes.get((key, value), 0))
+                        print(f'{indent + value:<44}{size:>12}')
                     valueCount += 1
             # If there were no active values, print empty
             if valueCount == 0:
                 print(indent + '(empty)')
 
+        if sizes is not None:
+            for kind, title in [('plugins', 'Plugins'), ('retention', 'Retention')]:
+                rows = sorted((name, size) for (rowKind, name), size in sizes.items() if rowKind == kind)
+                if rows:
+                    print(f'{title}:')
+                    for name, size in rows:
+                        print(f'{indent + name:<44}{formatSize(size):>12}')
+            print(f"\n{'Reclaimable':<44}{formatSize(sum(sizes.values())):>12}")
+            if isTrimmingCache():
+                print(f"{indent}DerivedDataCache is trimmed, so less of it is freed")
+            print(f"{indent}{len(index['folders'])} folders indexed, {scanned} changed, in {seconds * 1000:.0f} ms")
+            if unknown:
+                print(f"{indent}File patterns are not indexed, their size is shown as ?")
+
         print(f"\nGenerate project files set to {config['settings']['generateProjectFiles']}")
         print(f"Automatic compilation set to {config['settings']['compile']}")
+        print(f"Instant clean set to {config['settings']['instantClean']}")
+        print(f"Build log set to {config['settings']['buildLog'] or 'off'}")
+        print(f"Plugin cleaning set to {config['settings']['cleanPlugins']}")
+        if isTrimmingCache():
+            print(f"DerivedDataCache is trimmed to {formatSize(config['settings']['ddcBudget']) if config['settings']['ddcBudget'] else 'any size'}"
+                  f"{', ' + str(config['settings']['ddcMaxAge']) + ' days' if config['settings']['ddcMaxAge'] else ''}")
+        print(f"Delete threads set to {getDeleteWorkers()}")
+        if config['settings']['deleteRate'] or config['settings']['deleteBandwidth']:
+            limits = [f"{config['settings']['deleteRate']} files/s"] if config['settings']['deleteRate'] else []
+            limits += [f"{formatSize(config['settings']['deleteBandwidth'])}/s"] if config['settings']['deleteBandwidth'] else []
+            print(f"Delete rate limited to {', '.join(limits)}")
+        print(f"Largest first set to {config['settings']['largestFirst']}")
+        limits = config['settings']['watchLimits']
+        if any(limits.values()):
+            print(f"Watch limits: {', '.join(f'{name} {formatSize(limit)}' for name, limit in limits.items() if limit)}")
+        for folder, rule in config['retention'].items():
+            if isRetaining(rule):
+                print(f"{folder}: {describeRetention(rule)}")
+        matrix = config['settings']['buildMatrix']
+        print(f"Builds: {', '.join(matrix) if matrix else '(none)'}, {getBuildJobs(len(matrix))} at the same time"
+              f"{' (automatic)' if not config['settings']['buildJobs'] else ''}")
 
     # Opens folder select dialog and saves the path
     if args.uedir is not None:
         if args.uedir:
             givenPath = folderPrompt()
-            path = findFile(givenPath, "UnrealBuildTool.exe")
-            if path is not None and os.path.exists(path):
-                appdataSavedVars['ubtPath'] = path
+            path = indexTool(uprojectData.get('EngineAssociation', ''), givenPath, "UnrealBuildTool.exe")
+            if path is not None:
                 print("Successfully found Unreal Engine installation.")
             else:
                 print(f"Could not find UnrealBuildTool.exe in {givenPath}.")
@@ -298,9 +706,8 @@ def processArgs(args):
     if args.vsdir is not None:
         if args.vsdir:
             givenPath = folderPrompt()
-            path = findFile(givenPath, "devenv.exe")
-            if path is not None and os.path.exists(path):
-                appdataSavedVars['vsPath'] = path
+            path = indexTool('VisualStudio', givenPath, "devenv.exe")
+            if path is not None:
                 print("Successfully found Visual Studio installation.")
             else:
                 print(f"Could not find devenv.exe in {givenPath}.")
@@ -310,322 +717,3021 @@ def processArgs(args):
     saveData()
 
 
-def delete():
-    "Perform delete operation on all listed items"
+def normRule(value):
+    "Normalize a rule or relative path so they can be compared"
 
-    localconfig = config['fileManagement']
-    num_deleted = 0
-    for i, val in enumerate(localconfig['files']):
-        if val[0] == '/': continue
-        try:
-            os.remove(localconfig['files'][i])
-            num_deleted += 1
-        except PermissionError:
-            errorPrompt(f"Operation aborted: Permission was denied on a file or folder. Did you close unreal engine and you IDE?")
-            sys.exit()
-        except FileNotFoundError:
-            pass
+    value = value.replace('\\', '/').strip('/')
+    if value.startswith('./'):
+        value = value[2:]
+    # Windows paths are case insensitive
+    return value.lower() if os.name == 'nt' else value
 
-    for i, val in enumerate(localconfig['folders']):
-        if val[0] == '/': continue
-        try:
-            shutil.rmtree(localconfig['folders'][i])
-            num_deleted += 1
-        except PermissionError:
-            errorPrompt(f"Operation aborted: Permission was denied on a file or folder. Did you close unreal engine and you IDE?")
-            sys.exit()
-        except FileNotFoundError:
-            pass
 
-    for i, val in enumerate(localconfig['extensions']):
+def compileRules(localconfig):
+    "Compile the delete lists into lookup tables so one walk can check every rule at once"
+
+    matcher = {
+        'files': {},        # relative path -> rule
+        'folders': {},      # relative path -> rule
+        'extensions': {},   # last suffix -> [(normalized extension, rule)]
+        'globs': {'files': [], 'folders': []},
+        'recursive': False, # Rules can match at any depth
+        'depth': 0,         # Deepest folder a path rule can match in
+        'prefixes': set()   # Folders that contain a path rule
+    }
+
+    for kind in ['files', 'folders']:
+        patterns = []
+        for val in localconfig[kind]:
+            if val[0] == '/': continue
+            key = normRule(val)
+            if any(c in key for c in '*?['):
+                patterns.append(val)
+            else:
+                matcher[kind][key] = val
+                matcher['depth'] = max(matcher['depth'], key.count('/'))
+                parts = key.split('/')
+                matcher['prefixes'].update('/'.join(parts[:i]) for i in range(1, len(parts)))
+
+        # One regex for all globs, the named group tells which one matched
+        if patterns:
+            import re
+            import fnmatch
+            regex = '|'.join(f'(?P<g{i}>{fnmatch.translate(normRule(p))})' for i, p in enumerate(patterns))
+            matcher['globs'][kind] = [re.compile(regex), patterns]
+            matcher['recursive'] = True
+
+    # Intermediate is replaced by the build folders the scopes select
+    matcher['scopes'] = activeScopes(localconfig)
+    if matcher['scopes']:
+        matcher['folders'].pop(normRule('Intermediate'), None)
+
+    for val in localconfig['extensions']:
         if val[0] == '/': continue
-        for file in glob.glob('*' + localconfig['extensions'][i], root_dir = path, include_hidden = True):
-            try:
-                os.remove(file)
-                num_deleted += 1
-            except PermissionError:
-                errorPrompt(f"Operation aborted: Permission was denied on a file or folder. Did you close unreal engine and you IDE?")
-                sys.exit()
-            except FileNotFoundError:
-                pass
-        
+        ext = normRule(val)
+        suffix = ext[ext.rfind('.'):] if '.' in ext else ''
+        matcher['extensions'].setdefault(suffix, []).append((ext, val))
+        matcher['recursive'] = True
 
-    s = "s" if num_deleted > 1 or num_deleted == 0 else ""
-    print(f'Deleted {num_deleted} file{s}/folder{s}.')
+    return matcher
 
 
-def loadData():
-    "Load config"
+def activeScopes(localconfig):
+    "Returns the scopes to use, only if the Intermediate folder is being deleted"
 
-    # Local configuration file
-    global config
-    if os.path.exists('uct_config.json'):
-        with open('uct_config.json', 'r') as openfile:
-            # Reading from json file
-            config = json.load(openfile)
-    else:
-        config = defaultConfig
+    if 'Intermediate' not in localconfig['folders']:
+        return []
+    return localconfig.get('scopes', [])
 
-    # Localappdata configuration file
-    global appdataSavedVars
-    if os.path.exists(os.path.join(appdataSavedVarsPath, "UnrealCleanupTool/saved_data.json")):
-        with open(os.path.join(appdataSavedVarsPath, "UnrealCleanupTool/saved_data.json"), 'r') as openfile:
-            # Reading from json file
-            appdataSavedVars = json.load(openfile)
-    else:
-        appdataSavedVars = defaultAppdataSavedVars
 
-    global uprojectPath
-    for file in os.listdir("."):
-        if file.endswith(".uproject"):
-            uprojectPath = os.path.abspath(file)
+def parseScope(value):
+    "Normalize a platform/target/configuration scope. Returns None if it isn't one"
 
-    # Load uproject file into memory
-    global uprojectData
-    if uprojectPath is not None:
-        with open(uprojectPath, 'r') as openfile:
-                    uprojectData = json.load(openfile)
+    parts = value.replace('\\', '/').strip('/').split('/')
+    if len(parts) != 3 or not all(parts):
+        return None
+    return '/'.join(parts)
 
 
-def saveData():
-    # Local configuration file
-    json_object = json.dumps(config, indent = 4)
+def scopedFolders(base, scopes, listFolders):
+    "Yields (scope, path) for each build folder in an Intermediate folder that a scope selects"
+
+    import fnmatch
 
-    # Delete old file
-    if exists("uct_config.json"):
-        os.remove("uct_config.json")
+    # Build/Platform/Target/Configuration, UE5 can put an architecture folder before the target
+    build = f'{base}/Build'
+    seen = set()
+    for scope in scopes:
+        platform, target, configuration = scope.split('/')
+        for platformName in listFolders(build):
+            if not fnmatch.fnmatch(platformName, platform):
+                continue
+            platformPath = f'{build}/{platformName}'
+            targetPaths = []
+            for name in listFolders(platformPath):
+                # Told apart by name, a * for the target would match the architecture folder too
+                if name.lower() in buildArchitectures:
+                    targetPaths.extend(f'{platformPath}/{name}/{targetName}' for targetName in listFolders(f'{platformPath}/{name}')
+                                       if fnmatch.fnmatch(targetName, target))
+                elif fnmatch.fnmatch(name, target):
+                    targetPaths.append(f'{platformPath}/{name}')
+            for targetPath in targetPaths:
+                for name in listFolders(targetPath):
+                    folder = f'{targetPath}/{name}'
+                    if fnmatch.fnmatch(name, configuration) and folder not in seen:
+                        seen.add(folder)
+                        yield scope, folder
+
+
+def listFolders(folder):
+    "Returns the names of the folders in a folder, without links"
+
+    try:
+        with os.scandir(folder) as entries:
+            return [entry.name for entry in entries if entry.is_dir(follow_symlinks=False) and not isLink(entry)]
+    except OSError:
+        return []
 
-    # Create new file
-    fileMode = 'w'
 
-    with open("uct_config.json", fileMode) as outfile:
-        outfile.write(json_object)
+def matchGlob(matcher, kind, key):
+    "Returns the glob rule that matches a relative path, or None"
+
+    if not matcher['globs'][kind]:
+        return None
+    regex, patterns = matcher['globs'][kind]
+    match = regex.match(key)
+    return patterns[int(match.lastgroup[1:])] if match else None
+
+
+def matchExtension(matcher, name):
+    "Returns the extension rule that matches a file name, or None"
+
+    name = normRule(name)
+    suffix = name[name.rfind('.'):] if '.' in name else ''
+    for ext, rule in matcher['extensions'].get(suffix, []) + matcher['extensions'].get('', []):
+        if name.endswith(ext):
+            return rule
+    return None
+
+
+def walkTargets(matcher, root='.', pruned=()):
+    "Yields every file and folder under root that the compiled rules match, without descending into matched folders or the pruned ones"
+
+    # (folder, relative path, normalized relative path, depth, only exact rules apply)
+    folders = [(root, '', '', 0, False)]
+    while folders:
+        folder, rel, key, depth, exact = folders.pop()
         try:
-            # Make file hidden
-            subprocess.check_call(["attrib","+H","uct_config.json"])
-        except PermissionError:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except (FileNotFoundError, PermissionError):
+            continue
+
+        for entry in entries:
+            entryRel = os.path.join(rel, entry.name)
+            entryKey = f'{key}/{normRule(entry.name)}' if key else normRule(entry.name)
+
+            if entry.is_dir(follow_symlinks=False) and not isLink(entry):
+                if matcher['scopes'] and entryKey == normRule('Intermediate'):
+                    for scope, folder in scopedFolders(entryRel, matcher['scopes'], listFolders):
+                        yield {'rule': 'scopes', 'pattern': scope, 'path': os.path.normpath(folder), 'type': 'folder'}
+                    continue
+
+                rule = matcher['folders'].get(entryKey) or (None if exact else matchGlob(matcher, 'folders', entryKey))
+                if rule is not None:
+                    yield {'rule': 'folders', 'pattern': rule, 'path': entryRel, 'type': 'folder'}
+                elif entryKey in pruned:
+                    pass
+                # Skipped folders are only looked in for the rules that name a path inside them
+                elif entryKey in matcher['prefixes'] and (exact or entry.name in walkSkipFolders):
+                    folders.append((entry.path, entryRel, entryKey, depth + 1, True))
+                elif not exact and entry.name not in walkSkipFolders and (matcher['recursive'] or depth < matcher['depth']):
+                    folders.append((entry.path, entryRel, entryKey, depth + 1, False))
+                continue
+
+            rule = matcher['files'].get(entryKey) or (None if exact else matchGlob(matcher, 'files', entryKey))
+            if rule is not None:
+                yield {'rule': 'files', 'pattern': rule, 'path': entryRel, 'type': 'file'}
+                continue
+
+            if matcher['extensions'] and not exact:
+                rule = matchExtension(matcher, entry.name)
+                if rule is not None:
+                    yield {'rule': 'extensions', 'pattern': rule, 'path': entryRel, 'type': 'file'}
+
+
+def iterTargets():
+    "Yields every file and folder the delete rules match"
+
+    return trimTargets(projectTargets())
+
+
+def projectTargets():
+    "Yields what the delete rules match in the project, then the temporary folders of its plugins"
+
+    plugins = pluginFolders()
+    # Plugin folders are deleted whole by their own rule, nothing in them has to be looked at
+    yield from walkTargets(compileRules(config['fileManagement']), pruned={normRule(folder) for _, folder in plugins})
+    yield from pluginTargets(plugins)
+    yield from retentionTargets()
+
+
+def pluginFolders():
+    "Returns (plugin name, folder) for each temporary folder of the plugins that is cleaned"
+
+    if not config['settings']['cleanPlugins']:
+        return []
+    # Only the folders the project itself cleans
+    active = [folder for folder in pluginFolderNames if folder in config['fileManagement']['folders']]
+    if not active:
+        return []
+    return [(plugin['name'], os.path.join(plugin['folder'], folder)) for plugin in findPlugins() for folder in active]
+
+
+def pluginTargets(plugins):
+    "Yields the folders to delete in each plugin, one rule per plugin"
+
+    scopes = activeScopes(config['fileManagement'])
+    for name, pluginFolder in plugins:
+        if os.path.basename(pluginFolder) == 'Intermediate' and scopes:
+            for scope, scopedFolder in scopedFolders(pluginFolder, scopes, listFolders):
+                yield {'rule': f"plugin:{name}", 'pattern': scope, 'path': os.path.normpath(scopedFolder), 'type': 'folder'}
+        elif os.path.isdir(pluginFolder):
+            yield {'rule': f"plugin:{name}", 'pattern': os.path.basename(pluginFolder), 'path': pluginFolder, 'type': 'folder'}
+
+
+def retentionTargets():
+    "Yields what the retention rules delete and compress, the newest item of each folder is always kept"
+
+    # Folders that are deleted anyway are left to their rule
+    deleted = [normRule(folder) for folder in config['fileManagement']['folders'] if folder[0] != '/']
+    for folder, rule in config['retention'].items():
+        key = normRule(folder)
+        if not isRetaining(rule) or any(key == d or key.startswith(d + '/') for d in deleted):
+            continue
+        if not os.path.isdir(folder) or isLinkPath(folder):
+            continue
+
+        # Newest first
+        items = sorted(listRetained(folder, rule['items']), reverse=True)
+        cutoff = time.time() - rule['maxAge'] * 86400 if rule['maxAge'] > 0 else None
+        kept = []
+        removed = []
+        for i, item in enumerate(items):
+            tooMany = rule['keep'] > 0 and i >= rule['keep']
+            tooOld = cutoff is not None and item[0] < cutoff
+            (removed if i > 0 and (tooMany or tooOld) else kept).append(item)
+
+        # Oldest go first until the rest fits, sizes before compressing so there is room to spare
+        if rule['maxSize'] > 0:
+            total = sum(size for _, size, _ in kept)
+            while len(kept) > 1 and total > rule['maxSize']:
+                item = kept.pop()
+                removed.append(item)
+                total -= item[1]
+
+        if rule['items'] == 'folders':
+            for _, size, path in removed:
+                yield {'rule': 'retention', 'pattern': folder, 'path': path, 'type': 'folder'}
+        elif removed:
+            yield {'rule': 'retention', 'pattern': folder, 'path': folder, 'type': 'files', 'paths': [path for _, _, path in removed],
+                   'files': len(removed), 'bytes': sum(size for _, size, _ in removed)}
+
+        # The newest log is still being written to
+        compress = [item for item in kept[1:] if rule['compress'] and rule['items'] == 'files' and item[2].endswith('.log')]
+        if compress:
+            # What compressing saves isn't known until it is done
+            yield {'rule': 'retention', 'pattern': folder, 'path': folder, 'type': 'compress', 'paths': [path for _, _, path in compress],
+                   'files': len(compress), 'bytes': 0}
+
+
+def listRetained(folder, items):
+    "Returns (modify time, size, path) of the files in a folder and its subfolders, or of the folders directly in it"
+
+    result = []
+    folders = [folder]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and not isLink(entry):
+                        if items == 'folders':
+                            result.append((entry.stat(follow_symlinks=False).st_mtime, treeSize(entry.path)[1], entry.path))
+                        else:
+                            folders.append(entry.path)
+                    elif items == 'files':
+                        st = entry.stat(follow_symlinks=False)
+                        result.append((st.st_mtime, st.st_size, entry.path))
+        except (FileNotFoundError, PermissionError):
             pass
+    return result
 
 
-    # Localappdata configuration file
-    folder = os.path.join(appdataSavedVarsPath, "UnrealCleanupTool")
-    file = os.path.join(folder, "saved_data.json")
-    json_object = json.dumps(appdataSavedVars, indent = 4)
+def isRetaining(rule):
+    "Check if a retention rule does anything"
 
-    if not exists(folder):
-        os.mkdir(folder)
+    return bool(rule.get('keep') or rule.get('maxAge') or rule.get('maxSize') or rule.get('compress'))
 
-    # Delete old file
-    if exists(file):
-        os.remove(file)
 
-    # Create new file
-    fileMode = 'w'
-    with open(file, fileMode) as outfile:
-        outfile.write(json_object)
+def describeRetention(rule):
+    "Returns a retention rule in words"
 
+    parts = []
+    if rule['keep']:
+        parts.append(f"keep the newest {rule['keep']} {rule['items']}")
+    if rule['maxAge']:
+        parts.append(f"delete after {rule['maxAge']} days")
+    if rule['maxSize']:
+        parts.append(f"cap at {formatSize(rule['maxSize'])}")
+    if rule['compress']:
+        parts.append("compress old logs")
+    return ', '.join(parts) if parts else 'off'
 
-def findUnrealBuildTool():
-    "Returns the path of the unreal build tool"
 
-    # Check if we have it saved first
-    if appdataSavedVars["ubtPath"] is not None:
-        if os.path.exists(appdataSavedVars["ubtPath"]):
-            return appdataSavedVars["ubtPath"]
+def setRetention(folder, options):
+    "Change the retention rule of a folder from option=value arguments"
 
-    # Get engine version from uproject file
-    if uprojectPath is not None:
-        with open(uprojectPath, 'r') as openfile:
-                    uprojectData = json.load(openfile)
-    else:
-        print("Could not find uproject file.")
+    folder = folder.replace('\\', '/').strip('/')
+    rule = config['retention'].setdefault(folder, {'items': 'files', 'keep': 0, 'maxAge': 0, 'maxSize': 0, 'compress': False})
+    for option in options:
+        key, _, value = option.partition('=')
+        key = key.lower()
+        value = value.strip().lower()
+        try:
+            if key == 'off' and not value:
+                rule.update(keep=0, maxAge=0, maxSize=0, compress=False)
+            elif key == 'keep':
+                rule['keep'] = 0 if value == 'off' else int(value)
+            elif key == 'age':
+                rule['maxAge'] = 0 if value == 'off' else int(value)
+            elif key == 'size':
+                rule['maxSize'] = 0 if value == 'off' else parseSize(value)
+            elif key == 'gzip' and value in ('on', 'off'):
+                rule['compress'] = value == 'on'
+            elif key == 'items' and value in ('files', 'folders'):
+                rule['items'] = value
+            else:
+                print(f"Unknown retention option '{option}'. Use keep=N, age=DAYS, size=SIZE, gzip=on|off, items=files|folders or off.")
+                continue
+        except ValueError:
+            print(f"'{option}' is not a valid value.")
+            continue
+        if min(rule['keep'], rule['maxAge'], rule['maxSize']) < 0:
+            print("Retention limits can not be negative.")
+            rule.update(keep=max(0, rule['keep']), maxAge=max(0, rule['maxAge']), maxSize=max(0, rule['maxSize']))
+    print(f"{folder}: {describeRetention(rule)}")
+
+
+def compressFiles(paths, workers):
+    "Gzip files in parallel, replacing each with a .gz file if that is smaller. Returns the number of files compressed and bytes saved"
+
+    from concurrent.futures import ThreadPoolExecutor
+    files = 0
+    saved = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Files in use are compressed by a later run
+        for result in pool.map(compressFile, paths):
+            if result:
+                files += 1
+                saved += result
+    return files, saved
+
+
+def compressFile(file):
+    "Gzip a file a block at a time, keeping its modify time. Returns the bytes saved, 0 if it doesn't get smaller, None if it is gone or False if it is in use"
+
+    import gzip
+    import shutil
+    temp = file + '.gz.tmp'
+    try:
+        st = os.stat(file)
+        with open(file, 'rb') as infile, open(temp, 'wb') as outfile:
+            with gzip.GzipFile(filename=os.path.basename(file), mode='wb', fileobj=outfile, mtime=int(st.st_mtime)) as compressed:
+                shutil.copyfileobj(infile, compressed, 1024 * 1024)
+        os.utime(temp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        compressedSize = os.path.getsize(temp)
+        # Small logs can grow from the gzip header
+        if compressedSize >= st.st_size:
+            os.remove(temp)
+            return 0
+        # Remove the log first, if it is in use we keep it as it is
+        os.remove(file)
+        os.replace(temp, file + '.gz')
+        return st.st_size - compressedSize
+    except FileNotFoundError:
+        removeFileIfExists(temp)
         return None
+    except PermissionError:
+        removeFileIfExists(temp)
+        return False
+
+
+def findPlugins():
+    "Returns the plugins in the project, from the .uplugin files in Plugins and the extra plugin folders in the uproject file"
 
-    # Get the specific engine version install directory
-    key_path = r"SOFTWARE\EpicGames\Unreal Engine"
-    key_path = os.path.join(key_path, uprojectData['EngineAssociation'])
-    installed_directory = None
+    # Engine and marketplace plugins listed in the uproject file are not on disk here, and never cleaned
+    roots = ['Plugins']
+    for folder in uprojectData.get('AdditionalPluginDirectories', []):
+        try:
+            folder = os.path.relpath(os.path.abspath(folder))
+        except ValueError:
+            # On another drive
+            continue
+        # Shared plugin folders outside the project may be used by other projects
+        if not folder.startswith('..'):
+            roots.append(folder)
+
+    cache = readJson(pluginCacheFileName, {}, indent=None)
+    descriptors = {}
+    plugins = []
+    folders = roots
+    while folders:
+        folder = folders.pop()
+        subfolders = []
+        found = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name[0] != '.' and entry.name not in pluginSkipFolders:
+                            subfolders.append(entry.path)
+                    elif entry.name.endswith('.uplugin'):
+                        found.append(entry)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+
+        # Plugins are not nested, no need to look further down
+        if not found:
+            folders.extend(subfolders)
+            continue
+        for entry in found:
+            key = normRule(entry.path)
+            mtime = entry.stat().st_mtime_ns
+            descriptor = cache.get(key)
+            if descriptor is None or descriptor.get('mtime') != mtime:
+                descriptor = readPluginDescriptor(entry.path, mtime)
+                if descriptor is None:
+                    continue
+            descriptors[key] = descriptor
+            # Disabled plugins are cleaned too, their binaries are just as stale
+            plugins.append({'name': descriptor['name'], 'folder': folder})
+
+    # Projects without plugins don't get a cache file
+    if descriptors or exists(pluginCacheFileName):
+        writeJson(pluginCacheFileName, descriptors, hidden=True, indent=None)
+    return sorted(plugins, key=lambda plugin: plugin['folder'])
+
+
+def readPluginDescriptor(file, mtime):
+    "Read the parts of a .uplugin file UCT uses. Returns None if it isn't valid"
 
     try:
-        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, key_path, 0, winreg.KEY_READ)
-        installed_directory = winreg.QueryValueEx(key, "InstalledDirectory")[0]
-        winreg.CloseKey(key)
-    except FileNotFoundError:
-        pass
+        with open(file, 'r', encoding='utf-8-sig') as openfile:
+            data = json.load(openfile)
+    except (OSError, ValueError):
+        return None
+    # The plugin is named after its descriptor file
+    return {'mtime': mtime, 'name': os.path.splitext(os.path.basename(file))[0],
+            'modules': [module.get('Name') for module in data.get('Modules', []) if isinstance(module, dict)]}
 
-    if installed_directory is not None:
-        path = findFile(installed_directory, "UnrealBuildTool.exe")
-        if path is not None and os.path.exists(path) and os.path.basename(path) == "UnrealBuildTool.exe":
-            appdataSavedVars['ubtPath'] = path
-            saveData()
-            return path
-        else: 
-            return None
-    else:
-        print("Could not find Unreal Engine install directory with correct version. Please use -uedir to select the directory.")
-        return None    
 
+def trimTargets(targets):
+    "Replace the DerivedDataCache folder with the part of it to evict, if trimming"
 
-def findFile(root, filename):
-    for dirpath, dirnames, filenames in os.walk(root):
-        if filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            return os.path.abspath(file_path)
-    return None
+    trim = isTrimmingCache()
+    for target in targets:
+        # Only evict the cold part of the cache
+        if trim and target['type'] == 'folder' and normRule(target['path']) == normRule(derivedDataCacheFolder):
+            target = planTrim(target['path'])
+            if target is None:
+                continue
+        yield target
 
 
-def findExtension(root, ext):
-    for dirpath, dirnames, filenames in os.walk(root):
-        for file in filenames:
-            if file.endswith(ext):
-                file_path = os.path.join(dirpath, file)
-                return os.path.abspath(file_path)
-    return None
+def isTrimmingCache():
+    "Check if DerivedDataCache should be trimmed instead of deleted"
 
+    return config['settings']['ddcBudget'] > 0 or config['settings']['ddcMaxAge'] > 0
 
-def generateProjectFiles():
-    ubtPath = findUnrealBuildTool()
-    if ubtPath is None:
-        errorPrompt("Could not generate project files.")
-        return False
 
-    command = [ubtPath, "-projectfiles", uprojectPath]
-    try:
-        # Call UBT
-        subprocess.run(command, check=True)
-        #messagePrompt("Finished generating project files.")
-    except subprocess.CalledProcessError as e:
-        errorPrompt("Error generating project files.")
-        return False
+def planTrim(folder):
+    "Plan which cache files to evict, least recently used first, to get under the budget and max age. Returns a target or None"
 
-# devenv BowlingGame.sln /Build "Development Editor|Win64"
-def compile():
-    try:
-        projectName = uprojectData['Modules'][0]['Name']
-    except:
-        projectName = None
+    # One scan, keeping only what's needed to sort
+    entries = []
+    total = 0
+    folders = [folder]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) and not isLink(entry):
+                        folders.append(entry.path)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        # Access times are often not updated, the editor touches the modify time on cache hits
+                        entries.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+                        total += st.st_size
+        except (FileNotFoundError, PermissionError):
+            pass
 
-    path = findDevenv()
-    slnPath = findExtension(".", ".sln")
+    entries.sort()
+    budget = config['settings']['ddcBudget']
+    cutoff = time.time() - config['settings']['ddcMaxAge'] * 86400 if config['settings']['ddcMaxAge'] > 0 else None
+    paths = []
+    evicted = 0
+    for lastUsed, size, entryPath in entries:
+        tooOld = cutoff is not None and lastUsed < cutoff
+        overBudget = budget > 0 and total - evicted > budget
+        if not tooOld and not overBudget:
+            break
+        paths.append(entryPath)
+        evicted += size
+
+    if not paths:
+        return None
+    return {'rule': 'trim', 'pattern': derivedDataCacheFolder, 'path': folder, 'type': 'files', 'paths': paths, 'files': len(paths), 'bytes': evicted}
 
-    if path is None or slnPath is None:
-        errorPrompt("Could not compile.")
-        print("Path: " + str(path))
-        print("slnPath: " + str(slnPath))
-        return False
-    
-    # Remove .exe from path, idk why it doesn't work with it
-    if path.endswith(".exe"):
-        path = path[:-4]
-    print(path)
-    command = [path, slnPath, "/Build", "Development Editor|Win64"]
-    try:
-        # Call devenv (visual studio)
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
-        print("Command output:", result.stdout)
-        print("Command error:", result.stderr)
-        if not config['settings']['disableCompileMessage']: 
-            infoPrompt(f"'{projectName}' rebuilt successfully.")
-    except subprocess.CalledProcessError as e:
-        errorPrompt("Could not compile.")
-        print(e)
-        return False
 
-def findDevenv():
-    "Returns the path of the visual studio executable"
+def removeFiles(paths, workers, skipped):
+    "Delete a list of files in parallel, then any folders that became empty. Returns the number of files and bytes deleted, adds locked files to skipped"
 
-    # Check if we have it saved first
-    if appdataSavedVars.get("devenvPath") is not None:
-        if os.path.exists(appdataSavedVars["devenvPath"]):
-            return appdataSavedVars["devenvPath"]
-    
-    devenvPath = "C:\Program Files\Microsoft Visual Studio\2022\Community\Common7\IDE\devenv.exe"
-    if os.path.exists(devenvPath):
-        return devenvPath
-    
-    if os.path.exists("C:\Program Files\Microsoft Visual Studio"):
-        vsPath = findHighestVersion("C:\Program Files\Microsoft Visual Studio")
-        if vsPath is not None:
-            devenvPath = findFile(vsPath, "devenv.exe")
-            if devenvPath is not None:
-                return devenvPath
-            
-    print("Could not find Visual Studio install directory. Please use -vsdir to select the directory.")
-    return None
+    from concurrent.futures import ThreadPoolExecutor
+    files = 0
+    size = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for file, deleted in zip(paths, pool.map(removeUnlockedFile, paths, chunksize=256)):
+            if deleted is False:
+                skipped.append(file)
+            elif deleted is not None:
+                files += 1
+                size += deleted
+
+    # Deepest first, so parents can become empty too
+    for folder in sorted({os.path.dirname(p) for p in paths}, key=len, reverse=True):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    return files, size
 
 
-def findHighestVersion(root):
-    "Returns the path to the folder with the higest number in the name"
+def delete(targets=None):
+    "Perform delete operation on all listed items. Returns the number of items and bytes deleted and what was skipped"
 
-    highest_version = 0
-    highest_version_folder = ""
+    leftovers = openJournal()
+    if targets is None:
+        targets = iterTargets()
 
-    for entry in os.scandir(root):
-        if entry.is_dir():
-            try:
-                version_number = int(entry.name)
-                if version_number > highest_version:
-                    highest_version = version_number
-                    highest_version_folder = entry.path
-            except ValueError:
+    result = deleteTargets(resumeTargets(leftovers, targets))
+    return finishDelete([result])
+
+
+def resumeTargets(leftovers, targets):
+    "Yields what an interrupted run didn't finish, then the targets that weren't part of it"
+
+    seen = set()
+    for target in leftovers:
+        seen.add((target['type'], normRule(target['path'])))
+        yield target
+    for target in targets:
+        if (target['type'], normRule(target['path'])) not in seen:
+            yield target
+
+
+def deleteTargets(targets):
+    "Delete every target, retrying locked files. Returns the number of items and bytes deleted and what had to be skipped"
+
+    instant = config['settings']['instantClean']
+    num_deleted = 0
+    num_bytes = 0
+    skipped = []
+    # Plugin name -> [folders, bytes]
+    plugins = {}
+    # Files compressed and bytes saved, they are not counted as deleted
+    compressed = [0, 0]
+    startThrottle()
+    if config['settings']['largestFirst']:
+        targets = largestFirst(targets)
+    with phase('delete') as totals:
+        for target in targets:
+            if target['type'] == 'compress':
+                files, saved = compressOne(target)
+                compressed[0] += files
+                compressed[1] += saved
+                continue
+            # Plugins are small and many, they are deleted together at the end
+            if target['rule'].startswith('plugin:'):
+                plugins.setdefault(target['rule'][len('plugin:'):], []).append(target)
                 continue
+            deleted, size = deleteOne(target, instant, skipped, totals)
+            num_deleted += deleted
+            num_bytes += size
+
+        if plugins:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(len(plugins), getDeleteWorkers())) as pool:
+                results = pool.map(lambda group: [deleteOne(target, instant, skipped, totals) for target in group], plugins.values())
+                for name, result in zip(list(plugins), results):
+                    plugins[name] = [sum(deleted for deleted, _ in result), sum(size for _, size in result)]
+                    num_deleted += plugins[name][0]
+                    num_bytes += plugins[name][1]
+
+        # Locked files are often released a moment later, when the editor or a scanner lets go
+        skipped, files, size = retrySkipped(skipped)
+        num_bytes += size
+        countPhase(totals, files, size)
+    return {'deleted': num_deleted, 'bytes': num_bytes, 'skipped': skipped, 'plugins': plugins, 'compressed': compressed}
+
+
+def startThrottle():
+    "Start limiting the delete rate, if a limit is set. Deletes running side by side share one limit"
+
+    global throttle
+    settings = config['settings']
+    if not settings['deleteRate'] and not settings['deleteBandwidth']:
+        return
+    with throttleLock:
+        if throttle is None:
+            now = time.perf_counter()
+            throttle = {'rate': settings['deleteRate'], 'bandwidth': settings['deleteBandwidth'], 'scale': 1.0, 'lowest': 1.0,
+                        'ops': 0.0, 'bytes': 0.0, 'refilled': now, 'start': now, 'files': 0, 'deleted': 0,
+                        'window': now, 'latency': 0.0, 'samples': 0, 'baseline': None}
+
+
+def stopThrottle():
+    "Stop limiting the delete rate. Returns what was deleted under the limit, or None if there was no limit"
+
+    global throttle
+    with throttleLock:
+        stats, throttle = throttle, None
+    return stats
+
+
+def unlinkFile(file, size):
+    "Delete a file whose size is known, waiting for the rate limit first"
+
+    state = throttle
+    if state is None:
+        os.unlink(file)
+        return
+
+    with throttleLock:
+        now = time.perf_counter()
+        elapsed = now - state['refilled']
+        state['refilled'] = now
+        # A bucket per limit. They can go into debt, a big file then makes the next ones wait for the time it cost
+        wait = 0.0
+        if state['rate']:
+            rate = state['rate'] * state['scale']
+            state['ops'] = min(state['ops'] + elapsed * rate, rate * throttleBurst) - 1
+            wait = max(wait, -state['ops'] / rate)
+        if state['bandwidth']:
+            rate = state['bandwidth'] * state['scale']
+            state['bytes'] = min(state['bytes'] + elapsed * rate, rate * throttleBurst) - size
+            wait = max(wait, -state['bytes'] / rate)
+    if wait > 0:
+        time.sleep(wait)
+
+    start = time.perf_counter()
+    os.unlink(file)
+    end = time.perf_counter()
+
+    with throttleLock:
+        state['files'] += 1
+        state['deleted'] += size
+        state['latency'] += end - start
+        state['samples'] += 1
+        if end - state['window'] < throttleWindow:
+            return
+        latency = state['latency'] / state['samples']
+        state['window'] = end
+        state['latency'] = 0.0
+        state['samples'] = 0
+        # The fastest deletes seen lately are what an idle disk does
+        state['baseline'] = latency if state['baseline'] is None else min(latency, state['baseline'] * 1.05)
+        # Slower than that means the disk is busy, back off fast and come back slowly
+        if latency > state['baseline'] * throttleSlowdown:
+            state['scale'] = max(throttleMinScale, state['scale'] / 2)
+            state['lowest'] = min(state['lowest'], state['scale'])
+        else:
+            state['scale'] = min(1.0, state['scale'] + 0.1)
 
-    return highest_version_folder
 
+def largestFirst(targets):
+    "Returns the targets ordered by size, largest first, so the most space is freed early. Folder sizes come from the size index"
 
-# if it works it ain't stupid
-def checkgpf():
-    "Check if we can generate project files"
+    targets = list(targets)
+    # Deletes can run side by side, only one of them updates the index at a time
+    with sizeIndexLock:
+        folders = updateSizeIndex()[0]['folders']
 
-    # Check if we have a uproject file
-    if uprojectPath is None:
-        return {'success': False, 'message': 'Could not find uproject file.'}
+    def targetSize(target):
+        if target['type'] == 'folder':
+            return indexedSize(folders, normRule(target['path']))
+        if target.get('bytes'):
+            return target['bytes']
+        try:
+            return os.lstat(target['path']).st_size
+        except OSError:
+            return 0
 
-    if appdataSavedVars["ubtPath"] is not None:
-        if os.path.exists(appdataSavedVars["ubtPath"]):
-            return {'success': True, 'message': ''}
+    return sorted(targets, key=targetSize, reverse=True)
 
-    # Get engine version from uproject file
-    uprojectData = None
-    if uprojectPath is not None:
-        with open(uprojectPath, 'r') as openfile:
-                    uprojectData = json.load(openfile)
-    else:
-        return {'success': False, 'message': 'Could not find uproject file.'}
 
-    # Get the specific engine version install directory
-    key_path = r"SOFTWARE\EpicGames\Unreal Engine"
-    key_path = os.path.join(key_path, uprojectData['EngineAssociation'])
-    installed_directory = None
+def compressOne(target):
+    "Compress and journal a single target. Returns the number of files compressed and bytes saved"
 
-    try:
-        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, key_path, 0, winreg.KEY_READ)
-        installed_directory = winreg.QueryValueEx(key, "InstalledDirectory")[0]
-        winreg.CloseKey(key)
-    except FileNotFoundError:
-        pass
-    if installed_directory is not None:
-        if findFile(installed_directory, "UnrealBuildTool.exe") is not None:
-            return {'success': True, 'message': ''}
-    else:
-        return {'success': False, 'message': 'Could not find Unreal Engine install directory. Please use -uedir to select the directory.'}
+    with phase('compress'):
+        planned = journalPlan(target)
+        result = compressFiles(target['paths'], getDeleteWorkers())
+        journalDone(planned)
+    return result
 
 
-def main():
-    loadData()
-    if checkArgs():
-        processArgs(initArgs())
-    else:
-        # Check if we are in an unreal directory
-        if checkDirectory() == False: return
-        delete()
+def deleteOne(target, instant, skipped, totals):
+    "Delete and journal a single target. Returns the number of items and bytes deleted"
+
+    with phase(f"{target['rule']}: {target['pattern']}", 'rule') as counters:
+        planned = journalPlan(target)
+        deleted = 0
+        size = 0
+        try:
+            files, size = deleteTarget(target, instant, skipped)
+            deleted = 1
+            countPhase(counters, files, size)
+            if tracer is not None:
+                with tracer['lock']:
+                    countPhase(totals, files, size)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            skipped.append(target['path'])
+        journalDone(planned)
+    return deleted, size
+
+
+def retrySkipped(paths):
+    "Try deleting skipped files and folders again, waiting longer before each round. Returns what is still there and the number of files and bytes deleted"
+
+    files = 0
+    size = 0
+    for delay in deleteRetryDelays:
+        if not paths:
+            break
+        time.sleep(delay)
+        remaining = []
+        for skippedPath in paths:
+            # Read-only files can't be deleted on Windows
+            if os.name == 'nt':
+                try:
+                    os.chmod(skippedPath, stat.S_IWRITE)
+                except OSError:
+                    pass
+            try:
+                if os.path.isdir(skippedPath) and not isLinkPath(skippedPath):
+                    deletedFiles, deletedSize = removeTree(skippedPath, getDeleteWorkers(), remaining)
+                    files += deletedFiles
+                    size += deletedSize
+                else:
+                    size += removeFile(skippedPath)
+                    files += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                remaining.append(skippedPath)
+        paths = remaining
+    return paths, files, size
+
+
+def finishDelete(results):
+    "Report what was deleted and skipped, and empty the staging folder. Returns the combined totals"
+
+    num_deleted = sum(result['deleted'] for result in results)
+    num_bytes = sum(result['bytes'] for result in results)
+    skipped = [skippedPath for result in results for skippedPath in result['skipped']]
+    plugins = {name: totals for result in results for name, totals in result['plugins'].items()}
+    compressed = [sum(result['compressed'][0] for result in results), sum(result['compressed'][1] for result in results)]
+    closeJournal(skipped)
+    throttled = stopThrottle()
+
+    # Batch mode prints a combined report instead
+    if not headless:
+        s = "s" if num_deleted > 1 or num_deleted == 0 else ""
+        print(f'Deleted {num_deleted} file{s}/folder{s}.')
+        for name, (deleted, size) in sorted(plugins.items()):
+            print(f'    Plugin {name}: {deleted} folder{"s" if deleted != 1 else ""}, {formatSize(size)}')
+        if compressed[0]:
+            print(f'Compressed {compressed[0]} log{"s" if compressed[0] != 1 else ""}, saving {formatSize(compressed[1])}.')
+        if throttled is not None:
+            seconds = max(time.perf_counter() - throttled['start'], 1e-9)
+            print(f'Deleted {throttled["files"] / seconds:.0f} files/s, {formatSize(throttled["deleted"] / seconds)}/s under the rate limit'
+                  f'{", slowed down to " + format(throttled["lowest"], ".0%") + " of it when the disk was busy" if throttled["lowest"] < 1 else ""}.')
+        if skipped:
+            print(f'Skipped {len(skipped)} locked file{"s" if len(skipped) > 1 else ""}/folder{"s" if len(skipped) > 1 else ""}:')
+            for skippedPath in skipped[:20]:
+                print(f'    {skippedPath}')
+            if len(skipped) > 20:
+                print(f'    ...and {len(skipped) - 20} more')
+            errorPrompt(f"{len(skipped)} files or folders could not be deleted because they are in use. Did you close unreal engine and you IDE? Run the cleanup again to finish it.")
+
+    # Empty the staging folder, also picks up anything left by an interrupted earlier run
+    if exists(stagingFolderName):
+        if headless:
+            reapStaging()
+        else:
+            startReaper()
+
+    return {'deleted': num_deleted, 'bytes': num_bytes, 'skipped': skipped, 'plugins': plugins, 'compressed': compressed}
+
+
+def deleteTarget(target, instant, skipped):
+    "Delete one file, folder or list of files. Returns the number of files and bytes deleted, adds what is locked to skipped"
+
+    if target['type'] == 'folder':
+        # Staged folders are counted by the reaper
+        try:
+            if instant and stageFolder(target['path']):
+                return 0, 0
+        except PermissionError:
+            # Something inside is locked, delete the rest in place
+            pass
+        return removeTree(target['path'], getDeleteWorkers(), skipped)
+    elif target['type'] == 'files':
+        return removeFiles(target['paths'], getDeleteWorkers(), skipped)
+    return 1, removeFile(target['path'])
+
+
+def openJournal():
+    "Start journaling deletes. Returns the targets an interrupted earlier run didn't finish"
+
+    global journal
+    leftovers, planned = readJournal()
+    leftovers = activeLeftovers(leftovers)
+    created = planned is None
+    if created:
+        # Windows doesn't let hidden files be overwritten
+        removeFileIfExists(journalFileName)
+    handle = open(journalFileName, 'w' if created else 'a', encoding='utf-8')
+    if created:
+        handle.write(json.dumps({'journal': 1, 'root': os.path.abspath('.')}) + '\n')
+        handle.flush()
+        hideFile(journalFileName)
+    journal = {'file': handle, 'lock': threading.Lock(), 'planned': planned or 0}
+    return leftovers
+
+
+def activeLeftovers(leftovers):
+    "Returns the unfinished targets whose rules are still in use. What was skipped is always finished"
+
+    leftovers = [target for target in leftovers if isActiveTarget(target)]
+    if leftovers:
+        print(f'Resuming {len(leftovers)} unfinished delete{"s" if len(leftovers) > 1 else ""} from the last run.')
+    return leftovers
+
+
+def isActiveTarget(target):
+    "Check if the rule that picked a target would still delete it"
+
+    rule = target['rule']
+    pattern = target['pattern']
+    lists = config['fileManagement']
+    scopes = activeScopes(lists)
+    if rule in ('folders', 'files', 'extensions'):
+        if pattern not in lists[rule]:
+            return False
+        # Trimmed or scoped now, those are planned again
+        if rule == 'folders' and normRule(target['path']) == normRule(derivedDataCacheFolder) and isTrimmingCache():
+            return False
+        return not (rule == 'folders' and normRule(target['path']) == normRule('Intermediate') and scopes)
+    if rule == 'scopes':
+        return pattern in scopes
+    if rule.startswith('plugin:'):
+        if not config['settings']['cleanPlugins']:
+            return False
+        if pattern in pluginFolderNames:
+            return pattern in lists['folders'] and not (pattern == 'Intermediate' and scopes)
+        return pattern in scopes
+    if rule == 'trim':
+        return isTrimmingCache()
+    if rule == 'retention':
+        retention = config['retention'].get(pattern)
+        return retention is not None and isRetaining(retention) and (target['type'] != 'compress' or retention['compress'])
+    # Skipped and stashed
+    return True
+
+
+def readJournal():
+    "Returns the targets in the journal that were planned but not finished, and the number planned. None if there is no usable journal"
+
+    try:
+        with open(journalFileName, 'r', encoding='utf-8') as openfile:
+            header = json.loads(openfile.readline())
+            # Copied from another project
+            if header.get('root') != os.path.abspath('.'):
+                return [], None
+            targets = []
+            done = set()
+            for line in openfile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Cut off by a crash
+                    continue
+                if 'plan' in record:
+                    targets.append(record['plan'])
+                elif 'done' in record:
+                    done.add(record['done'])
+    except (OSError, ValueError, AttributeError):
+        return [], None
+    return [target for i, target in enumerate(targets) if i not in done], len(targets)
+
+
+def journalPlan(target):
+    "Write a target to the journal before deleting it. Returns its number"
+
+    if journal is None:
+        return None
+    with journal['lock']:
+        journal['file'].write(json.dumps({'plan': target}) + '\n')
+        journal['file'].flush()
+        journal['planned'] += 1
+        return journal['planned'] - 1
+
+
+def journalDone(planned):
+    "Mark a target in the journal as deleted"
+
+    if journal is None:
+        return
+    with journal['lock']:
+        journal['file'].write(json.dumps({'done': planned}) + '\n')
+        journal['file'].flush()
+
+
+def closeJournal(skipped):
+    "Finish the journal. It is removed when everything was deleted, otherwise only the skipped paths are kept for the next run"
+
+    global journal
+    if journal is None:
+        return
+    journal['file'].close()
+    journal = None
+
+    if not skipped:
+        removeFileIfExists(journalFileName)
+        return
+
+    lines = [json.dumps({'journal': 1, 'root': os.path.abspath('.')})]
+    for skippedPath in skipped:
+        lines.append(json.dumps({'plan': {'rule': 'skipped', 'pattern': skippedPath, 'path': skippedPath,
+                                          'type': 'folder' if os.path.isdir(skippedPath) else 'file'}}))
+    temp = journalFileName + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+    replaceFile(temp, journalFileName)
+
+
+def treeSize(root):
+    "Returns the number of files and bytes in a folder, without following links"
+
+    files = 0
+    size = 0
+    # Only the folders still to visit are kept in memory
+    folders = [root]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and not isLink(entry):
+                        folders.append(entry.path)
+                    else:
+                        # Cached by scandir on Windows, so this is free there
+                        size += entry.stat(follow_symlinks=False).st_size
+                        files += 1
+        except (FileNotFoundError, PermissionError):
+            pass
+    return files, size
+
+
+def updateSizeIndex(root='.'):
+    "Bring the size index up to date and return it with the number of folders listed. Only folders whose modify time changed are listed again"
+
+    # A file that changes size in place doesn't touch its folder, that is picked up the next time the folder changes
+    try:
+        old = readJson(sizeIndexFile(root), {'folders': {}}, indent=None)['folders']
+    except (ValueError, KeyError, TypeError):
+        old = {}
+
+    # Normalized relative path -> {'mtime', 'files', 'bytes', 'extensions': {extension: [files, bytes]}, 'folders': [names]}
+    folders = {}
+    scanned = 0
+    stack = [(root, '')]
+    while stack:
+        folder, key = stack.pop()
+        try:
+            mtime = os.stat(folder, follow_symlinks=False).st_mtime_ns
+        except OSError:
+            continue
+        entry = old.get(key)
+        if entry is None or entry.get('mtime') != mtime:
+            entry = scanFolder(folder, mtime)
+            if entry is None:
+                continue
+            scanned += 1
+        folders[key] = entry
+        for name in entry['folders']:
+            stack.append((os.path.join(folder, name), f'{key}/{normRule(name)}' if key else normRule(name)))
+
+    # Deleted folders are not reached, so they drop out here
+    index = {'folders': folders}
+    writeJson(sizeIndexFile(root), index, indent=None)
+    return index, scanned
+
+
+def scanFolder(folder, mtime):
+    "List a single folder for the size index. Returns its entry, or None if it can't be read"
+
+    entry = {'mtime': mtime, 'files': 0, 'bytes': 0, 'extensions': {}, 'folders': []}
+    try:
+        with os.scandir(folder) as it:
+            for e in it:
+                # Folders the delete walk skips are indexed too, they count towards the size of the project
+                if e.is_dir(follow_symlinks=False) and not isLink(e):
+                    entry['folders'].append(e.name)
+                    continue
+                size = e.stat(follow_symlinks=False).st_size
+                # Everything from the first dot, so any extension rule can be checked against it
+                name = normRule(e.name)
+                stats = entry['extensions'].setdefault(name[name.find('.'):] if '.' in name else '', [0, 0])
+                stats[0] += 1
+                stats[1] += size
+                entry['files'] += 1
+                entry['bytes'] += size
+    except (FileNotFoundError, PermissionError):
+        return None
+    return entry
+
+
+def indexedSize(folders, key):
+    "Returns the number of bytes in a folder in the size index, including its subfolders"
+
+    size = 0
+    stack = [key]
+    while stack:
+        key = stack.pop()
+        entry = folders.get(key)
+        if entry is None:
+            continue
+        size += entry['bytes']
+        stack.extend(f'{key}/{normRule(name)}' if key else normRule(name) for name in entry['folders'])
+    return size
+
+
+def reclaimable(index, matcher, plugins=()):
+    "Returns the bytes a clean would free per (list, rule), worked out from the size index the way projectTargets picks targets"
+
+    folders = index['folders']
+    sizes = {}
+    pruned = {normRule(folder) for _, folder in plugins}
+    # Exact file rules are looked up in the folder they are in
+    fileRules = {}
+    for key, rule in matcher['files'].items():
+        fileRules.setdefault(key.rpartition('/')[0], []).append((key, rule))
+
+    # (normalized relative path, depth, only exact rules apply)
+    stack = [('', 0, False)]
+    while stack:
+        key, depth, exact = stack.pop()
+        entry = folders.get(key)
+        if entry is None:
+            continue
+
+        extensions = {ext: list(stats) for ext, stats in entry['extensions'].items()}
+        for fileKey, rule in fileRules.get(key, []):
+            try:
+                size = os.stat(fileKey, follow_symlinks=False).st_size
+            except OSError:
+                continue
+            sizes[('files', rule)] = sizes.get(('files', rule), 0) + size
+            # Don't count it again as an extension
+            name = fileKey.rpartition('/')[2]
+            stats = extensions.get(name[name.find('.'):] if '.' in name else '')
+            if stats is not None:
+                stats[0] -= 1
+                stats[1] -= size
+
+        if matcher['extensions'] and not exact:
+            for ext, (count, size) in extensions.items():
+                rule = matchExtension(matcher, ext)
+                if rule is not None and count > 0:
+                    sizes[('extensions', rule)] = sizes.get(('extensions', rule), 0) + size
+
+        for name in entry['folders']:
+            childKey = f'{key}/{normRule(name)}' if key else normRule(name)
+            if matcher['scopes'] and childKey == normRule('Intermediate'):
+                listIndexed = lambda folder: folders.get(normRule(folder), {}).get('folders', [])
+                for scope, folder in scopedFolders(childKey, matcher['scopes'], listIndexed):
+                    sizes[('scopes', scope)] = sizes.get(('scopes', scope), 0) + indexedSize(folders, normRule(folder))
+                continue
+
+            rule = matcher['folders'].get(childKey) or (None if exact else matchGlob(matcher, 'folders', childKey))
+            if rule is not None:
+                sizes[('folders', rule)] = sizes.get(('folders', rule), 0) + indexedSize(folders, childKey)
+            elif childKey in pruned:
+                pass
+            elif childKey in matcher['prefixes'] and (exact or name in walkSkipFolders):
+                stack.append((childKey, depth + 1, True))
+            elif not exact and name not in walkSkipFolders and (matcher['recursive'] or depth < matcher['depth']):
+                stack.append((childKey, depth + 1, False))
+
+    # One row per plugin, like the delete report
+    listIndexed = lambda folder: folders.get(normRule(folder), {}).get('folders', [])
+    for name, pluginFolder in plugins:
+        if os.path.basename(pluginFolder) == 'Intermediate' and matcher['scopes']:
+            size = sum(indexedSize(folders, normRule(folder)) for _, folder in scopedFolders(pluginFolder, matcher['scopes'], listIndexed))
+        else:
+            size = indexedSize(folders, normRule(pluginFolder))
+        sizes[('plugins', name)] = sizes.get(('plugins', name), 0) + size
+
+    # Compressing frees an unknown part, it isn't counted
+    for target in retentionTargets():
+        if target['type'] == 'folder':
+            size = indexedSize(folders, normRule(target['path']))
+        elif target['type'] == 'files':
+            size = target['bytes']
+        else:
+            continue
+        sizes[('retention', target['pattern'])] = sizes.get(('retention', target['pattern']), 0) + size
+    return sizes
+
+
+def plan(manifestPath=None):
+    "Show what a clean would delete without deleting anything, optionally saving it as a manifest"
+
+    manifest = None
+    if manifestPath:
+        manifest = open(manifestPath, 'w')
+        manifest.write(json.dumps({'uct': 'plan', 'version': 1, 'root': os.path.abspath('.')}) + '\n')
+
+    # Totals per rule, keyed by (rule, pattern)
+    totals = {}
+    try:
+        # An interrupted clean is finished first, the same as a real run would
+        for target in resumeTargets(activeLeftovers(readJournal()[0]), iterTargets()):
+            if target['type'] == 'folder':
+                target['files'], target['bytes'] = treeSize(target['path'])
+            elif target['type'] == 'file':
+                try:
+                    target['files'], target['bytes'] = 1, os.lstat(target['path']).st_size
+                except FileNotFoundError:
+                    # A leftover that was deleted after all
+                    continue
+            print(f"    {target['path']:<50}{target['files']:>10} files{formatSize(target['bytes']):>12}")
+
+            total = totals.setdefault((target['rule'], target['pattern']), [0, 0, 0])
+            total[0] += 1
+            total[1] += target['files']
+            total[2] += target['bytes']
+
+            if manifest is not None:
+                manifest.write(json.dumps(target) + '\n')
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    print(f'\n{"Rule":<50}{"Matches":>10}{"Files":>10}{"Size":>12}')
+    for (rule, pattern), (matches, files, size) in totals.items():
+        print(f'{rule + ": " + pattern:<50}{matches:>10}{files:>10}{formatSize(size):>12}')
+    print(f'{"Total":<50}{sum(t[0] for t in totals.values()):>10}{sum(t[1] for t in totals.values()):>10}{formatSize(sum(t[2] for t in totals.values())):>12}')
+
+    if manifest is not None:
+        print(f'\nPlan saved to {manifestPath}. Use -execute {manifestPath} to run it.')
+
+
+def readManifest(manifestPath):
+    "Opens a plan manifest. Returns a generator of the targets that still match what is on disk"
+
+    openfile = open(manifestPath, 'r')
+    try:
+        header = json.loads(openfile.readline())
+        if header.get('uct') != 'plan':
+            raise ValueError(f'{manifestPath} is not a plan manifest.')
+        if os.path.normcase(header['root']) != os.path.normcase(os.path.abspath('.')):
+            raise ValueError(f"This plan was made for {header['root']}.")
+    except BaseException:
+        openfile.close()
+        raise
+    return iterManifest(openfile)
+
+
+def iterManifest(openfile):
+    "Yields the targets in an open plan manifest, one line at a time"
+
+    with openfile:
+        for line in openfile:
+            target = json.loads(line)
+            # Lists of files are checked one by one when they are deleted
+            if target['type'] in ('files', 'compress'):
+                yield target
+                continue
+            # Skip anything that changed type since the plan was made
+            isFolder = os.path.isdir(target['path']) and not os.path.islink(target['path'])
+            if isFolder != (target['type'] == 'folder'):
+                if os.path.lexists(target['path']):
+                    print(f"Skipping {target['path']}, it changed since the plan was made.")
+                continue
+            yield target
+
+
+def removeFile(file):
+    "Delete a single file. Returns its size"
+
+    size = os.lstat(file).st_size
+    unlinkFile(file, size)
+    return size
+
+
+def removeFileIfExists(file):
+    "Delete a single file. Returns its size, or None if it was already gone"
+
+    try:
+        return removeFile(file)
+    except FileNotFoundError:
+        return None
+
+
+def parseSize(text):
+    "Parse a size like 512M or 20G into bytes"
+
+    text = text.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def stageFolder(folder):
+    "Move a folder into the staging folder. Returns False if it has to be deleted in place instead"
+
+    staging = os.path.abspath(stagingFolderName)
+    if not exists(staging):
+        os.mkdir(staging)
+        hideFile(staging)
+    elif isLinkPath(staging):
+        return False
+
+    # Unique name, so folders staged by earlier runs don't collide
+    name = f'{os.path.basename(os.path.normpath(folder))}-{time.time_ns()}'
+    try:
+        os.rename(folder, os.path.join(staging, name))
+    except (PermissionError, FileNotFoundError):
+        # Locked or missing, let the caller handle it like a normal delete
+        raise
+    except OSError:
+        # Can't be renamed (e.g. on another volume)
+        return False
+    return True
+
+
+def startReaper():
+    "Empty the staging folder in a separate process that keeps running after we exit"
+
+    import subprocess
+    command = [sys.executable, os.path.abspath(__file__), '-reap']
+    if os.name == 'nt':
+        flags = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=flags)
+    else:
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def reapStaging():
+    "Delete everything inside the staging folder"
+
+    staging = os.path.abspath(stagingFolderName)
+
+    # Never follow the staging folder somewhere else
+    if not os.path.isdir(staging) or isLinkPath(staging):
+        return
+    # The reaper runs next to whatever the user does next, so it keeps to the rate limit too
+    startThrottle()
+
+    # Anything not deleted (interrupted, locked) is picked up again by the next run
+    with os.scandir(staging) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False) and not isLink(entry):
+                    removeTree(entry.path, getDeleteWorkers())
+                else:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+    try:
+        os.rmdir(staging)
+    except OSError:
+        pass
+
+
+def getDeleteWorkers():
+    "Returns the number of threads to delete with"
+
+    workers = config['settings'].get('deleteWorkers', 0)
+    if workers > 0:
+        return workers
+    # Deleting is bound by per-file syscall latency, not CPU, so oversubscribe
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def isLink(entry):
+    "Check if a directory entry is a symlink or junction, which must be unlinked instead of descended into"
+
+    if entry.is_symlink():
+        return True
+    if os.name == 'nt':
+        return getattr(entry.stat(follow_symlinks=False), 'st_reparse_tag', 0) == stat.IO_REPARSE_TAG_MOUNT_POINT
+    return False
+
+
+def isLinkPath(path):
+    "Check if a path is a symlink or junction"
+
+    if os.path.islink(path):
+        return True
+    if os.name == 'nt':
+        return getattr(os.lstat(path), 'st_reparse_tag', 0) == stat.IO_REPARSE_TAG_MOUNT_POINT
+    return False
+
+
+def clearDirectory(folder):
+    "Delete all files in a folder. Returns the list of subfolders, the number of files and bytes deleted and the files that are locked"
+
+    subfolders = []
+    files = 0
+    size = 0
+    skipped = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and not isLink(entry):
+                    subfolders.append(entry.path)
+                else:
+                    try:
+                        # Free on Windows, scandir already has the stat result
+                        entrySize = entry.stat(follow_symlinks=False).st_size
+                        unlinkFile(entry.path, entrySize)
+                        files += 1
+                        size += entrySize
+                    except FileNotFoundError:
+                        pass
+                    except PermissionError:
+                        skipped.append(entry.path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        skipped.append(folder)
+    return subfolders, files, size, skipped
+
+
+def removeFolder(folder):
+    "Remove an empty folder. Returns False if it is locked"
+
+    try:
+        os.rmdir(folder)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        return False
+    except OSError:
+        # Not empty, something inside was skipped
+        pass
+    return True
+
+
+def removeUnlockedFile(file):
+    "Delete a single file. Returns its size, None if it was already gone or False if it is locked"
+
+    try:
+        return removeFileIfExists(file)
+    except PermissionError:
+        return False
+
+
+def removeTree(root, workers, skipped=None):
+    "Delete a folder and everything in it, using a pool of threads to walk and unlink in parallel. Returns the number of files and bytes deleted"
+
+    # Locked files are left in place and added to skipped. Without a list to add them to, that is an error
+    locked = [] if skipped is None else skipped
+
+    # Unlink symlinks instead of deleting what they point to
+    if os.path.islink(root):
+        os.unlink(root)
+        return 0, 0
+    if not os.path.isdir(root):
+        raise FileNotFoundError(root)
+
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    # Every folder we found, grouped by depth so they can be removed deepest first
+    levels = [[root]]
+    files = 0
+    size = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(clearDirectory, root): 0}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    depth = pending.pop(future) + 1
+                    subfolders, deletedFiles, deletedSize, lockedFiles = future.result()
+                    files += deletedFiles
+                    size += deletedSize
+                    locked.extend(lockedFiles)
+                    for subfolder in subfolders:
+                        if depth == len(levels):
+                            levels.append([])
+                        levels[depth].append(subfolder)
+                        pending[pool.submit(clearDirectory, subfolder)] = depth
+        except BaseException:
+            # Don't keep deleting in the background after an error
+            for future in pending:
+                future.cancel()
+            raise
+
+        # All files are gone, remove the folders bottom-up
+        for level in reversed(levels):
+            for folder, removed in zip(level, pool.map(removeFolder, level)):
+                if not removed:
+                    locked.append(folder)
+
+    if skipped is None and locked:
+        raise PermissionError(13, 'Permission denied', locked[0])
+    return files, size
+
+
+def stash(name):
+    "Archive the stash folders into the stash folder, then delete them"
+
+    folders = [folder for folder in stashFolders if os.path.isdir(folder) and not isLinkPath(folder)]
+    if not folders:
+        print(f"Nothing to stash, there is no {' or '.join(stashFolders)} folder.")
+        return
+    name = name or time.strftime('stash-%Y%m%d-%H%M%S')
+    if not exists(stashFolderName):
+        os.mkdir(stashFolderName)
+        hideFile(stashFolderName)
+
+    archive = os.path.join(stashFolderName, name + '.uctstash')
+    temp = archive + '.tmp'
+    start = time.perf_counter()
+    try:
+        files, size, compressed = writeStash(temp, folders)
+    except (OSError, ValueError) as e:
+        removeFileIfExists(temp)
+        print(f'Could not stash: {e}')
+        return
+    replaceFile(temp, archive)
+    print(f"Stashed {files} files ({formatSize(size)}) from {', '.join(folders)} into '{name}', "
+          f"{formatSize(compressed)} in {time.perf_counter() - start:.1f}s.")
+
+    # Only deleted once the archive is safely written
+    finishDelete([deleteTargets({'rule': 'stash', 'pattern': folder, 'path': folder, 'type': 'folder'} for folder in folders)])
+
+
+def restore(name):
+    "Restore stashed folders, replacing the ones that are there now. The archive is checked while it is read"
+
+    archives = sorted((entry.stat().st_mtime, entry.name[:-len('.uctstash')]) for entry in os.scandir(stashFolderName)
+                      if entry.name.endswith('.uctstash')) if os.path.isdir(stashFolderName) else []
+    if not archives:
+        print("There are no stashes to restore.")
+        return
+    name = name or archives[-1][1]
+    if name not in [archiveName for _, archiveName in archives]:
+        print(f"There is no stash called '{name}'. Stashes: {', '.join(archiveName for _, archiveName in archives)}")
+        return
+
+    # Unpacked next to the project first, so a damaged archive never replaces anything
+    restoring = os.path.join(stashFolderName, 'restoring')
+    start = time.perf_counter()
+    try:
+        # Left by an earlier restore that couldn't finish
+        if os.path.isdir(restoring):
+            removeTree(restoring, getDeleteWorkers())
+        files, size = readStash(os.path.join(stashFolderName, name + '.uctstash'), restoring)
+    except (OSError, ValueError) as e:
+        if os.path.isdir(restoring):
+            removeTree(restoring, getDeleteWorkers(), [])
+        print(f"Could not restore '{name}': {e}")
+        return
+
+    try:
+        for folder in sorted(os.listdir(restoring)):
+            if exists(folder):
+                removeTree(folder, getDeleteWorkers())
+            os.rename(os.path.join(restoring, folder), folder)
+        os.rmdir(restoring)
+    except OSError as e:
+        print(f"Could not replace the current folders, is the project open? The restored files are in {restoring}. ({e})")
+        return
+    print(f"Restored {files} files ({formatSize(size)}) from '{name}' in {time.perf_counter() - start:.1f}s.")
+
+
+def writeStash(file, folders):
+    "Stream folders into an archive of independently compressed chunks, compressing several at a time. Returns the number of files, bytes and compressed bytes"
+
+    import struct
+    import zlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = getDeleteWorkers()
+    # Chunks waiting to be compressed or written, this bounds the memory used
+    pending = deque()
+    buffer = bytearray()
+    totals = {'files': 0, 'bytes': 0, 'compressed': len(stashMagic)}
+
+    def compressChunk(data):
+        return len(data), zlib.crc32(data), zlib.compress(data, stashLevel)
+
+    def writeChunk(result):
+        raw, crc, data = result
+        out.write(struct.pack('<III', raw, len(data), crc))
+        out.write(data)
+        totals['compressed'] += 12 + len(data)
+
+    def emit(data):
+        buffer.extend(data)
+        while len(buffer) >= stashChunkSize:
+            submit(bytes(buffer[:stashChunkSize]))
+            del buffer[:stashChunkSize]
+
+    def submit(data):
+        # zlib lets go of the GIL, so the chunks are compressed in parallel
+        if len(pending) >= workers * 2:
+            writeChunk(pending.popleft().result())
+        pending.append(pool.submit(compressChunk, data))
+
+    with open(file, 'wb') as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        out.write(stashMagic)
+        stack = list(folders)
+        while stack:
+            folder = stack.pop()
+            name = folder.replace(os.sep, '/').encode('utf-8')
+            emit(b'd' + struct.pack('<H', len(name)) + name)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # Links are not followed or kept
+                        if not isLink(entry):
+                            stack.append(entry.path)
+                        continue
+                    if entry.is_symlink():
+                        continue
+                    name = entry.path.replace(os.sep, '/').encode('utf-8')
+                    with open(entry.path, 'rb') as infile:
+                        st = os.fstat(infile.fileno())
+                        emit(b'f' + struct.pack('<HQQ', len(name), st.st_size, st.st_mtime_ns) + name)
+                        remaining = st.st_size
+                        while remaining:
+                            block = infile.read(min(remaining, stashChunkSize))
+                            if not block:
+                                raise ValueError(f'{entry.path} changed while it was stashed')
+                            emit(block)
+                            remaining -= len(block)
+                    totals['files'] += 1
+                    totals['bytes'] += st.st_size
+
+        emit(b'e' + struct.pack('<QQ', totals['files'], totals['bytes']))
+        if buffer:
+            submit(bytes(buffer))
+        while pending:
+            writeChunk(pending.popleft().result())
+        out.write(struct.pack('<III', 0, 0, 0))
+        out.flush()
+        os.fsync(out.fileno())
+    return totals['files'], totals['bytes'], totals['compressed'] + 12
+
+
+def readStash(file, destination):
+    "Unpack an archive into a folder, decompressing several chunks at a time. Every chunk and the totals are checked. Returns the number of files and bytes"
+
+    import struct
+    import zlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = getDeleteWorkers()
+
+    def decompressChunk(data, raw, crc):
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            raise ValueError('the archive is damaged, a chunk can not be decompressed') from None
+        if len(data) != raw or zlib.crc32(data) != crc:
+            raise ValueError('the archive is damaged, a chunk failed its check')
+        return data
+
+    def readChunks():
+        # Only a few chunks are in memory at a time, in the order they were written
+        pending = deque()
+        while True:
+            header = infile.read(12)
+            if len(header) < 12:
+                raise ValueError('the archive is cut off')
+            raw, size, crc = struct.unpack('<III', header)
+            if raw == 0 and size == 0:
+                break
+            data = infile.read(size)
+            if len(data) < size:
+                raise ValueError('the archive is cut off')
+            pending.append(pool.submit(decompressChunk, data, raw, crc))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    state = {'data': b'', 'pos': 0}
+
+    def read(size, exact=True):
+        # The next size bytes of the unpacked stream, or as many as are ready if not exact
+        while len(state['data']) - state['pos'] < (size if exact else 1):
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                raise ValueError('the archive is cut off') from None
+            state['data'] = state['data'][state['pos']:] + chunk
+            state['pos'] = 0
+        end = state['pos'] + size
+        data = state['data'][state['pos']:end]
+        state['pos'] += len(data)
+        return data
+
+    def target(name):
+        # Never write outside the destination
+        parts = name.decode('utf-8').split('/')
+        if not parts[0] or '..' in parts or '' in parts or ':' in parts[0]:
+            raise ValueError(f"the archive contains an unsafe path '{name.decode('utf-8', 'replace')}'")
+        return os.path.join(destination, *parts)
+
+    files = 0
+    size = 0
+    with open(file, 'rb') as infile, ThreadPoolExecutor(max_workers=workers) as pool:
+        if infile.read(len(stashMagic)) != stashMagic:
+            raise ValueError('this is not a stash archive')
+        chunks = readChunks()
+        while True:
+            kind = read(1)
+            if kind == b'd':
+                length, = struct.unpack('<H', read(2))
+                os.makedirs(target(read(length)), exist_ok=True)
+            elif kind == b'f':
+                length, fileSize, mtime = struct.unpack('<HQQ', read(18))
+                path = target(read(length))
+                with open(path, 'wb') as outfile:
+                    remaining = fileSize
+                    while remaining:
+                        block = read(min(remaining, stashChunkSize), exact=False)
+                        outfile.write(block)
+                        remaining -= len(block)
+                # The cache trim goes by modify time
+                os.utime(path, ns=(mtime, mtime))
+                files += 1
+                size += fileSize
+            elif kind == b'e':
+                expectedFiles, expectedSize = struct.unpack('<QQ', read(16))
+                if (expectedFiles, expectedSize) != (files, size):
+                    raise ValueError('the archive is damaged, the totals do not match')
+                break
+            else:
+                raise ValueError('the archive is damaged')
+        for _ in chunks:
+            raise ValueError('the archive is damaged, there is data after the end')
+    return files, size
+
+
+def findProjects(root):
+    "Returns the folders under root that contain a .uproject file"
+
+    projects = []
+    folders = [os.path.abspath(root)]
+    while folders:
+        folder = folders.pop(0)
+        subfolders = []
+        isProject = False
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name[0] != '.' and entry.name not in batchSkipFolders:
+                            subfolders.append(entry.path)
+                    elif entry.name.endswith('.uproject'):
+                        isProject = True
+        except OSError:
+            continue
+
+        # Projects are not nested, no need to look further down
+        if isProject:
+            projects.append(folder)
+        else:
+            folders.extend(subfolders)
+
+    return sorted(projects)
+
+
+def cleanProject(projectDir):
+    "Clean a single project without user interaction. Runs in a batch worker process"
+
+    global headless, path
+    headless = True
+    report = {'project': projectDir, 'seconds': 0.0, 'deleted': 0, 'bytes': 0, 'error': None}
+    start = time.perf_counter()
+    try:
+        os.chdir(projectDir)
+        path = projectDir
+        loadData()
+        # We wait for the deletes anyway, so there's nothing to gain from renaming first
+        config['settings']['instantClean'] = False
+        result = delete()
+        report.update(deleted=result['deleted'], bytes=result['bytes'])
+        if result['skipped']:
+            report['error'] = f"{len(result['skipped'])} locked files skipped, is the project open?"
+    except (OSError, ValueError) as e:
+        report['error'] = str(e)
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def formatSize(size):
+    "Returns a human readable file size"
+
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def runBatch(root, jobs):
+    "Clean every project under root in parallel and print a report"
+
+    if not os.path.isdir(root):
+        print(f"Error: '{root}' is not a folder.")
+        return
+    projects = findProjects(root)
+    if not projects:
+        print(f'No unreal projects found in {root}.')
+        return
+
+    jobs = jobs if jobs is not None and jobs > 0 else min(len(projects), os.cpu_count() or 1)
+    print(f'Cleaning {len(projects)} project{"s" if len(projects) > 1 else ""} with {jobs} job{"s" if jobs > 1 else ""}...')
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    start = time.perf_counter()
+    reports = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for future in as_completed([pool.submit(cleanProject, project) for project in projects]):
+            reports.append(future.result())
+    seconds = time.perf_counter() - start
+
+    # Combined report
+    print()
+    print(f'{"Project":<40}{"Time":>10}{"Deleted":>10}{"Reclaimed":>12}')
+    for report in sorted(reports, key=lambda r: r['project']):
+        name = os.path.relpath(report['project'], root)
+        if report['error'] is not None:
+            print(f'{name:<40}{report["seconds"]:>9.2f}s  Error: {report["error"]}')
+        else:
+            print(f'{name:<40}{report["seconds"]:>9.2f}s{report["deleted"]:>10}{formatSize(report["bytes"]):>12}')
+    print(f'{"Total":<40}{seconds:>9.2f}s{sum(r["deleted"] for r in reports):>10}{formatSize(sum(r["bytes"] for r in reports)):>12}')
+
+
+def hashFile(path):
+    "Hash a file in blocks, so large files are never read into memory at once"
+
+    import hashlib
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as openfile:
+        while True:
+            block = openfile.read(dedupeBlockSize)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scanCacheFiles(folder):
+    "Returns (path, stat) for every file in a DerivedDataCache folder that is large enough to be worth linking"
+
+    files = []
+    folders = [folder]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if isLink(entry):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    else:
+                        info = entry.stat(follow_symlinks=False)
+                        if info.st_size >= dedupeMinSize:
+                            files.append((entry.path, info))
+        except (FileNotFoundError, PermissionError):
+            continue
+    return files
+
+
+def linkFile(source, file, info):
+    "Replace file with a hardlink to source, if it hasn't changed since it was hashed. Returns True if it was replaced"
+
+    temp = file + '.uctlink'
+    try:
+        current = os.stat(file)
+        if (current.st_size, current.st_mtime_ns) != (info.st_size, info.st_mtime_ns):
+            return False
+        os.link(source, temp)
+        os.replace(temp, file)
+        return True
+    except OSError:
+        # Another volume, too many links, or the editor has the file open
+        removeFileIfExists(temp)
+        return False
+
+
+def dedupe(root):
+    "Replace identical DerivedDataCache files in every project under root with hardlinks into a shared store"
+
+    if not os.path.isdir(root):
+        print(f"Error: '{root}' is not a folder.")
+        return
+    root = os.path.abspath(root)
+    projects = findProjects(root)
+    folders = [os.path.join(project, derivedDataCacheFolder) for project in projects]
+    folders = [folder for folder in folders if os.path.isdir(folder) and not isLinkPath(folder)]
+    if not folders:
+        print(f'No {derivedDataCacheFolder} folders found in {root}.')
+        return
+
+    start = time.perf_counter()
+    store = os.path.join(root, dedupeStoreName)
+    cacheFile = os.path.join(store, dedupeCacheFileName)
+    stored = {os.path.basename(file): (file, info) for file, info in scanCacheFiles(store) if file != cacheFile}
+    files = [file for folder in folders for file in scanCacheFiles(folder)]
+
+    # A file can only have a duplicate if another file, or a stored one, has the same size
+    sizes = {}
+    for file, info in files:
+        sizes.setdefault(info.st_size, set()).add((info.st_dev, info.st_ino))
+    storedSizes = {info.st_size for _, info in stored.values()}
+    candidates = [(file, info) for file, info in files if len(sizes[info.st_size]) > 1 or info.st_size in storedSizes]
+
+    # Known files whose size and modify time haven't changed keep their hash
+    cache = readJson(cacheFile, {}, indent=None)
+    hashes = {}
+    pending = []
+    for file, info in candidates:
+        key = os.path.normcase(file)
+        known = cache.get(key)
+        if known is not None and known[:2] == [info.st_size, info.st_mtime_ns]:
+            hashes[file] = known[2]
+        else:
+            pending.append((file, info))
+
+    def tryHash(file):
+        try:
+            return hashFile(file)
+        except OSError:
+            return None
+
+    hashedBytes = 0
+    if pending:
+        from concurrent.futures import ThreadPoolExecutor
+        # hashlib releases the GIL on large blocks, so threads hash in parallel
+        with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as pool:
+            for (file, info), digest in zip(pending, pool.map(tryHash, [file for file, _ in pending])):
+                if digest is not None:
+                    hashes[file] = digest
+                    hashedBytes += info.st_size
+
+    groups = {}
+    for file, info in candidates:
+        if file in hashes:
+            groups.setdefault((info.st_size, hashes[file]), []).append((file, info))
+
+    linked = 0
+    saved = 0
+    failed = 0
+    for (size, digest), members in groups.items():
+        if digest in stored and stored[digest][1].st_size == size:
+            source, sourceInfo = stored[digest]
+        else:
+            # Content only one file has doesn't need to be stored
+            if len({(info.st_dev, info.st_ino) for _, info in members}) < 2:
+                continue
+            source = os.path.join(store, digest[:2], digest)
+            sourceInfo = members[0][1]
+            try:
+                if not exists(store):
+                    os.mkdir(store)
+                    hideFile(store)
+                os.makedirs(os.path.dirname(source), exist_ok=True)
+                os.link(members[0][0], source)
+            except OSError:
+                failed += len(members)
+                continue
+            stored[digest] = (source, sourceInfo)
+        for file, info in members:
+            if (info.st_dev, info.st_ino) == (sourceInfo.st_dev, sourceInfo.st_ino):
+                continue
+            if linkFile(source, file, info):
+                linked += 1
+                # Other links keep the old copy on disk, so it only frees space when this was the last one
+                if info.st_nlink == 1:
+                    saved += size
+            else:
+                failed += 1
+
+    # Stored files no project links to anymore, their caches were deleted or trimmed
+    for digest, (file, _) in list(stored.items()):
+        try:
+            if os.stat(file).st_nlink == 1:
+                os.remove(file)
+                os.rmdir(os.path.dirname(file))
+        except OSError:
+            pass
+
+    # Linked files changed inode, store what they are now so the next run doesn't hash them again
+    newCache = {}
+    for file, digest in hashes.items():
+        try:
+            info = os.stat(file)
+        except OSError:
+            continue
+        newCache[os.path.normcase(file)] = [info.st_size, info.st_mtime_ns, digest]
+    if newCache or exists(cacheFile):
+        if not exists(store):
+            os.mkdir(store)
+            hideFile(store)
+        writeJson(cacheFile, newCache, indent=None)
+
+    print(f'Checked {len(files)} files in {len(folders)} project{"s" if len(folders) > 1 else ""}, hashed {len(pending)} ({formatSize(hashedBytes)}).')
+    print(f'Linked {linked} duplicate files, reclaimed {formatSize(saved)} in {time.perf_counter() - start:.1f}s.')
+    if failed:
+        print(f'{failed} files could not be linked, they may be open or on another drive.')
+
+
+def watch(root, interval):
+    "Keep checking the projects under root, and clean one when it goes over its watch limits"
+
+    global headless
+    headless = True
+    if not os.path.isdir(root):
+        print(f"Error: '{root}' is not a folder.")
+        return
+    root = os.path.abspath(root)
+    projects = findProjects(root)
+    if not projects:
+        print(f'No unreal projects found in {root}.')
+        return
+    interval = interval if interval is not None and interval > 0 else watchInterval
+    lowerPriority()
+
+    # Over a limit once means one clean, it has to go back under before it is cleaned again
+    armed = {project: True for project in projects}
+    stats = {'start': time.perf_counter(), 'polls': 0, 'folders': 0, 'listed': 0, 'seconds': 0.0, 'cpu': 0.0, 'cleans': 0}
+    print(f'Watching {len(projects)} project{"s" if len(projects) > 1 else ""} every {interval}s, press Ctrl+C to stop.')
+    nextReport = time.perf_counter() + watchReportSeconds
+    try:
+        while True:
+            seconds = stats['seconds']
+            for project in projects:
+                armed[project] = checkProject(project, armed[project], stats)
+            stats['polls'] += 1
+            seconds = stats['seconds'] - seconds
+            if time.perf_counter() >= nextReport:
+                printWatchReport(stats)
+                nextReport = time.perf_counter() + watchReportSeconds
+            # Big trees are checked less often, so checking never takes more than a small part of the time
+            time.sleep(max(interval, seconds / watchDutyCycle - seconds))
+    except KeyboardInterrupt:
+        pass
+    print()
+    printWatchReport(stats)
+
+
+def checkProject(project, armed, stats):
+    "Check a project against its watch limits and clean it if it is over one. Returns whether it can be cleaned the next time"
+
+    os.chdir(project)
+    try:
+        loadData()
+        limits = config['settings']['watchLimits']
+        cpu = time.process_time()
+        start = time.perf_counter()
+        # Only folders that changed since the last check are listed again
+        index, scanned = updateSizeIndex()
+    except (OSError, ValueError) as e:
+        print(f'{time.strftime("%H:%M:%S")} {os.path.basename(project)}: could not check, {e}')
+        return armed
+    stats['seconds'] += time.perf_counter() - start
+    stats['cpu'] += time.process_time() - cpu
+    stats['folders'] += len(index['folders'])
+    stats['listed'] += scanned
+
+    sizes = {name: indexedSize(index['folders'], '' if name == 'total' else normRule(name)) for name in limits}
+    over = [name for name, limit in limits.items() if limit > 0 and sizes[name] > limit]
+    if not over:
+        return True
+    if not armed:
+        return False
+
+    print(f'{time.strftime("%H:%M:%S")} {os.path.basename(project)}: '
+          f'{", ".join(f"{name} is {formatSize(sizes[name])} (limit {formatSize(limits[name])})" for name in over)}, cleaning...')
+    # Each clean is its own run in the history
+    startTracing(None)
+    report = cleanProject(project)
+    recordRun(report['error'] is None)
+    stats['cleans'] += 1
+    if report['error'] is not None:
+        print(f'{time.strftime("%H:%M:%S")} {os.path.basename(project)}: {report["error"]}')
+    print(f'{time.strftime("%H:%M:%S")} {os.path.basename(project)}: deleted {report["deleted"]} files, '
+          f'reclaimed {formatSize(report["bytes"])} in {report["seconds"]:.1f}s.')
+    return False
+
+
+def printWatchReport(stats):
+    "Print what watching has cost so far"
+
+    polls = max(stats['polls'], 1)
+    elapsed = time.perf_counter() - stats['start']
+    print(f'{time.strftime("%H:%M:%S")} {stats["polls"]} checks, {stats["folders"] // polls} folders checked and '
+          f'{stats["listed"] / polls:.1f} listed per check, {stats["seconds"] / polls * 1000:.0f} ms and '
+          f'{stats["cpu"] / polls * 1000:.0f} ms CPU per check, {stats["cpu"] / max(elapsed, 1e-9) * 100:.2f}% CPU, '
+          f'{stats["cleans"]} clean{"s" if stats["cleans"] != 1 else ""}.')
+
+
+def lowerPriority():
+    "Run at background priority, so watching doesn't take CPU or disk time from builds"
+
+    if os.name == 'nt':
+        import ctypes
+        # Lowers the I/O priority as well as the CPU priority
+        PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+        ctypes.windll.kernel32.SetPriorityClass(ctypes.windll.kernel32.GetCurrentProcess(), PROCESS_MODE_BACKGROUND_BEGIN)
+        return
+    try:
+        os.nice(10)
+    except (OSError, AttributeError):
+        pass
+
+
+def loadData():
+    "Load config"
+
+    # Local configuration file
+    global config
+    config = readJson(configFileName, defaultConfig)
+
+    # Add settings introduced after the config file was created
+    for section, values in defaultConfig.items():
+        for key, value in values.items():
+            config.setdefault(section, {}).setdefault(key, copy.deepcopy(value))
+
+    # Localappdata configuration file
+    global appdataSavedVars
+    appdataSavedVars = readJson(savedDataFile(), defaultAppdataSavedVars)
+
+    for key, value in defaultAppdataSavedVars.items():
+        appdataSavedVars.setdefault(key, copy.deepcopy(value))
+
+    global uprojectPath
+    for file in os.listdir("."):
+        if file.endswith(".uproject"):
+            uprojectPath = os.path.abspath(file)
+
+    # Load uproject file into memory, everything else uses this copy
+    global uprojectData
+    if uprojectPath is not None:
+        with open(uprojectPath, 'r') as openfile:
+            uprojectData = json.load(openfile)
+
+        # -uedir used to save one path for every engine version, it goes to the version of the first project it is used in
+        legacyPath = appdataSavedVars.get('ubtPath')
+        if legacyPath:
+            association = uprojectData.get('EngineAssociation', '')
+            if os.path.isfile(legacyPath) and lookupTool(association, "UnrealBuildTool.exe") is None:
+                parts = os.path.abspath(legacyPath).split(os.sep)
+                root = os.sep.join(parts[:parts.index('Engine')]) if 'Engine' in parts[1:] else os.path.dirname(legacyPath)
+                addToIndex(association, root, "UnrealBuildTool.exe", legacyPath)
+            appdataSavedVars['ubtPath'] = None
+
+
+def saveData():
+    "Save config, only the files that changed are written"
+
+    writeJson(configFileName, config, hidden=True)
+    writeJson(savedDataFile(), appdataSavedVars)
+
+
+def savedDataFile():
+    "Returns the path of the localappdata configuration file"
+
+    return os.path.join(appdataSavedVarsPath, "UnrealCleanupTool", "saved_data.json")
+
+
+def sizeIndexFile(root):
+    "Returns the path of the size index of a project folder"
+
+    import hashlib
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(root)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(appdataSavedVarsPath, "UnrealCleanupTool", sizeIndexFolderName, key + ".json")
+
+
+def readJson(file, default, indent=4):
+    "Read a JSON file, or a copy of default if it doesn't exist. Remembers what was read so unchanged data isn't written back"
+
+    try:
+        with open(file, 'r') as openfile:
+            data = json.load(openfile)
+    except FileNotFoundError:
+        savedFiles[os.path.abspath(file)] = None
+        return copy.deepcopy(default)
+
+    savedFiles[os.path.abspath(file)] = json.dumps(data, indent = indent)
+    return data
+
+
+def writeJson(file, data, hidden=False, indent=4):
+    "Write a JSON file if the data changed since it was read. Returns True if it was written"
+
+    json_object = json.dumps(data, indent = indent)
+    key = os.path.abspath(file)
+    created = not exists(file)
+    if not created and savedFiles.get(key) == json_object:
+        return False
+
+    folder = os.path.dirname(key)
+    if not exists(folder):
+        os.makedirs(folder)
+
+    # Write a temporary file and swap it in, so a crash never leaves a half written file
+    temp = file + '.tmp'
+    with open(temp, 'w') as outfile:
+        outfile.write(json_object)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    replaceFile(temp, file)
+
+    # Replacing keeps the attribute, so this only has to happen once
+    if created and hidden:
+        hideFile(file)
+
+    savedFiles[key] = json_object
+    return True
+
+
+def replaceFile(source, destination):
+    "Atomically replace destination with source, keeping the file attributes (like hidden) of destination on Windows"
+
+    if os.name == 'nt' and exists(destination):
+        import ctypes
+        if ctypes.windll.kernel32.ReplaceFileW(destination, source, None, 0, None, None):
+            return
+    os.replace(source, destination)
+
+
+def hideFile(file):
+    "Make a file or folder hidden in the explorer"
+
+    # Files are hidden by their name on other systems
+    if os.name != 'nt':
+        return
+    import subprocess
+    try:
+        subprocess.check_call(["attrib","+H",file])
+    except PermissionError:
+        pass
+
+
+def findUnrealBuildTool():
+    "Returns the path of the unreal build tool"
+
+    path, message = locateUnrealBuildTool()
+    if path is None:
+        print(message)
+    return path
+
+
+def locateUnrealBuildTool():
+    "Returns the path of the unreal build tool for the project's engine version, and an error message if it wasn't found"
+
+    if uprojectPath is None:
+        return None, "Could not find uproject file."
+    association = uprojectData.get('EngineAssociation', '')
+
+    # Check if we have it saved first
+    path = lookupTool(association, "UnrealBuildTool.exe")
+    if path is not None:
+        return path, ''
+
+    # Index every installed engine version, so switching versions later doesn't search again
+    installs = findEngineInstalls()
+    for version, installed_directory in installs.items():
+        if version != association:
+            indexTool(version, installed_directory, "UnrealBuildTool.exe", search=False)
+
+    if association not in installs:
+        saveData()
+        return None, "Could not find Unreal Engine install directory with correct version. Please use -uedir to select the directory."
+
+    # Only search the whole install for the version we need right now
+    path = indexTool(association, installs[association], "UnrealBuildTool.exe")
+    saveData()
+    if path is None:
+        return None, f"Could not find UnrealBuildTool.exe in {installs[association]}. Please use -uedir to select the directory."
+    return path, ''
+
+
+def findEngineInstalls():
+    "Returns the install directory of every unreal engine version on this machine, keyed by engine association"
+
+    import winreg
+    installs = {}
+
+    # Launcher installs
+    try:
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\EpicGames\Unreal Engine", 0, winreg.KEY_READ)
+        i = 0
+        while True:
+            try:
+                version = winreg.EnumKey(key, i)
+            except OSError:
+                break
+            try:
+                subkey = winreg.OpenKey(key, version)
+                installs[version] = winreg.QueryValueEx(subkey, "InstalledDirectory")[0]
+                winreg.CloseKey(subkey)
+            except FileNotFoundError:
+                pass
+            i += 1
+        winreg.CloseKey(key)
+    except FileNotFoundError:
+        pass
+
+    # Source builds, associated by a GUID
+    try:
+        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Epic Games\Unreal Engine\Builds", 0, winreg.KEY_READ)
+        i = 0
+        while True:
+            try:
+                name, value, _ = winreg.EnumValue(key, i)
+            except OSError:
+                break
+            installs[name] = value
+            i += 1
+        winreg.CloseKey(key)
+    except FileNotFoundError:
+        pass
+
+    # The launcher also keeps a list of installs that may be missing from the registry
+    launcherFile = os.path.join(os.environ.get('PROGRAMDATA', r"C:\ProgramData"), "Epic", "UnrealEngineLauncher", "LauncherInstalled.dat")
+    try:
+        with open(launcherFile, 'r') as openfile:
+            for install in json.load(openfile).get('InstallationList', []):
+                if install.get('AppName', '').startswith('UE_'):
+                    installs.setdefault(install['AppName'][3:], install['InstallLocation'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return installs
+
+
+def lookupTool(association, toolName):
+    "Returns the indexed path of a tool, if it is still valid"
+
+    for root, entry in appdataSavedVars['toolIndex'].items():
+        if entry['association'] != association or toolName not in entry['tools']:
+            continue
+        tool = entry['tools'][toolName]
+        # Moved or uninstalled. Updated in place is fine, the location is still good
+        if not os.path.isfile(tool['path']):
+            del entry['tools'][toolName]
+            continue
+        return tool['path']
+    return None
+
+
+def indexTool(association, root, toolName, search=True):
+    "Find a tool in an install directory and add it to the index. Returns its path"
+
+    if search:
+        path = findFile(root, toolName)
+    else:
+        path = checkKnownLocations([root], toolName)
+    if path is None:
+        return None
+
+    addToIndex(association, root, toolName, path)
+    return path
+
+
+def addToIndex(association, root, toolName, path):
+    "Save the location of a tool in the index"
+
+    entry = appdataSavedVars['toolIndex'].setdefault(os.path.abspath(root), {'association': association, 'tools': {}})
+    entry['association'] = association
+    entry['tools'][toolName] = {'path': path}
+
+
+def checkKnownLocations(roots, filename):
+    "Returns the first well-known location of a file that exists in any of the roots"
+
+    for root in roots:
+        for location in knownToolLocations.get(filename, []):
+            candidate = os.path.join(root, location)
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+    return None
+
+
+def searchRoot(root, match, maxDepth, found):
+    "Breadth first search of one root for a file name that matches. Gives up when another search has found it"
+
+    folders = deque([(root, 0)])
+    while folders and not found.is_set():
+        folder, depth = folders.popleft()
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth < maxDepth and entry.name not in searchSkipFolders:
+                            subfolders.append(entry.path)
+                    elif match(entry.name):
+                        found.set()
+                        return os.path.abspath(entry.path)
+        except (FileNotFoundError, PermissionError, NotADirectoryError):
+            continue
+        folders.extend((subfolder, depth + 1) for subfolder in subfolders)
+    return None
+
+
+def searchFiles(roots, match, knownFile=None, maxDepth=searchMaxDepth):
+    "Search several roots at once for a file name that matches, checking well-known locations first"
+
+    if knownFile is not None:
+        path = checkKnownLocations(roots, knownFile)
+        if path is not None:
+            return path
+
+    # Searching one root doesn't need a thread
+    found = threading.Event()
+    if len(roots) == 1:
+        return searchRoot(roots[0], match, maxDepth, found)
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=len(roots)) as pool:
+        futures = [pool.submit(searchRoot, root, match, maxDepth, found) for root in roots]
+        for future in as_completed(futures):
+            if future.result() is not None:
+                return future.result()
+    return None
+
+
+def findFile(root, filename):
+    "Returns the path of a file with the given name under root"
+
+    if os.name == 'nt':
+        lowered = filename.lower()
+        return searchFiles([root], lambda name: name.lower() == lowered, filename)
+    return searchFiles([root], lambda name: name == filename, filename)
+
+
+def findExtension(root, ext):
+    "Returns the path of a file with the given extension under root"
+
+    if os.name == 'nt':
+        ext = ext.lower()
+        return searchFiles([root], lambda name: name.lower().endswith(ext))
+    return searchFiles([root], lambda name: name.endswith(ext))
+
+
+def generateProjectFiles():
+    ubtPath = findUnrealBuildTool()
+    if ubtPath is None:
+        errorPrompt("Could not generate project files.")
+        return False
+
+    command = [ubtPath, "-projectfiles", uprojectPath]
+    # Call UBT
+    result = runBuild(command, "Generate project files")
+    if result['returncode'] != 0:
+        errorPrompt("Error generating project files.")
+        return False
+    #messagePrompt("Finished generating project files.")
+
+# devenv BowlingGame.sln /Build "Development Editor|Win64"
+def compile():
+    try:
+        projectName = uprojectData['Modules'][0]['Name']
+    except:
+        projectName = None
+
+    path = findDevenv()
+    slnPath = findExtension(".", ".sln")
+
+    if path is None or slnPath is None:
+        errorPrompt("Could not compile.")
+        print("Path: " + str(path))
+        print("slnPath: " + str(slnPath))
+        return False
+    
+    # Remove .exe from path, idk why it doesn't work with it
+    if path.endswith(".exe"):
+        path = path[:-4]
+    print(path)
+    # Call devenv (visual studio), once for each configuration
+    results = compileMatrix(path, slnPath, config['settings']['buildMatrix'] or defaultConfig['settings']['buildMatrix'])
+    if any(result['status'] != 'ok' for result in results):
+        errorPrompt("Could not compile.")
+        return False
+    if not config['settings']['disableCompileMessage']:
+        infoPrompt(f"'{projectName}' rebuilt successfully.")
+
+
+def compileMatrix(path, slnPath, matrix):
+    "Build each configuration, several at a time. The first failure stops the rest. Returns a result for each configuration"
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    jobs = getBuildJobs(len(matrix))
+    if len(matrix) > 1:
+        print(f'Building {len(matrix)} configurations, {jobs} at a time.')
+    running = {'stop': False, 'processes': [], 'lock': threading.Lock()}
+    log = openBuildLog(config['settings'].get('buildLog', ''))
+
+    def build(configuration):
+        if running['stop']:
+            return {'configuration': configuration, 'status': 'cancelled', 'seconds': 0.0, 'errorCount': 0, 'warningCount': 0}
+        with phase(f'compile {configuration}', 'build'):
+            # Output of builds running side by side is told apart by the prefix
+            result = runBuild([path, slnPath, "/Build", configuration], configuration,
+                              f'[{configuration}] ' if jobs > 1 else '', log, running)
+        result['configuration'] = configuration
+        if result['returncode'] == 0:
+            result['status'] = 'ok'
+        elif running['stop']:
+            result['status'] = 'cancelled'
+        else:
+            result['status'] = 'failed'
+            with running['lock']:
+                running['stop'] = True
+                for process in running['processes']:
+                    stopProcess(process)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(build, matrix))
+    finally:
+        closeBuildLog(log)
+
+    if len(matrix) > 1:
+        print(f'\n{"Configuration":<32}{"Result":<11}{"Time":>9}{"Errors":>8}{"Warnings":>10}')
+        for result in results:
+            print(f"{result['configuration']:<32}{result['status']:<11}{result['seconds']:>8.1f}s{result['errorCount']:>8}{result['warningCount']:>10}")
+    return results
+
+
+def parseBuild(value):
+    "Normalize a configuration|platform build. Returns None if it isn't one"
+
+    configuration, _, platform = value.partition('|')
+    if not configuration.strip() or not platform.strip():
+        return None
+    return f'{configuration.strip()}|{platform.strip()}'
+
+
+def getBuildJobs(count):
+    "Returns how many of count builds to run at the same time, limited by the cores and the free memory unless set"
+
+    jobs = config['settings'].get('buildJobs', 0)
+    if jobs <= 0:
+        jobs = max(1, (os.cpu_count() or 1) // buildCoresPerJob)
+        memory = availableMemory()
+        if memory is not None:
+            jobs = min(jobs, max(1, memory // buildMemoryPerJob))
+    return max(1, min(jobs, count))
+
+
+def availableMemory():
+    "Returns the free physical memory in bytes, or None if it is not known"
+
+    if os.name == 'nt':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('length', ctypes.c_ulong), ('memoryLoad', ctypes.c_ulong), ('totalPhys', ctypes.c_ulonglong),
+                        ('availPhys', ctypes.c_ulonglong), ('totalPageFile', ctypes.c_ulonglong), ('availPageFile', ctypes.c_ulonglong),
+                        ('totalVirtual', ctypes.c_ulonglong), ('availVirtual', ctypes.c_ulonglong), ('availExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.length = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.availPhys
+        return None
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def stopProcess(process):
+    "Stop a build and the compilers it started"
+
+    if process.poll() is not None:
+        return
+    if os.name == 'nt':
+        import subprocess
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        process.terminate()
+
+
+def runBuild(command, label, prefix='', log=None, running=None):
+    "Run a build tool, printing its output as it comes and picking out errors, warnings and progress. Returns a summary"
+
+    import subprocess
+    import re
+
+    # MSVC/MSBuild: 'File.cpp(12): error C2065: ...', UBT: 'ERROR: ...'
+    errorPattern = re.compile(r'(?:^|:\s*)(?:fatal\s+)?error\b\s*[A-Z]*\d*\s*:', re.IGNORECASE)
+    warningPattern = re.compile(r'(?:^|:\s*)warning\b\s*[A-Z]*\d*\s*:', re.IGNORECASE)
+    # devenv: '1>------ Build started: Project: MyGame, Configuration: ...', UBT: '[12/345] Compile Module.cpp'
+    projectPattern = re.compile(r'Build started: Project: ([^,]+)')
+    actionPattern = re.compile(r'^\[(\d+)/(\d+)\]')
+
+    result = {'returncode': None, 'errors': [], 'errorCount': 0, 'warningCount': 0, 'projects': 0, 'actions': 0, 'lines': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                   text=True, errors='replace', bufsize=1)
+    except OSError as e:
+        print(f'{label} failed to start: {e}')
+        return result
+
+    # Builds running side by side can be stopped by the others
+    if running is not None:
+        with running['lock']:
+            running['processes'].append(process)
+            if running['stop']:
+                stopProcess(process)
+    ownLog = log is None
+    if ownLog:
+        log = openBuildLog(config['settings'].get('buildLog', ''))
+
+    # Only the current line and a capped list of errors are kept in memory
+    with process.stdout:
+        for line in process.stdout:
+            line = line.rstrip('\r\n')
+            result['lines'] += 1
+            print(prefix + line, flush=True)
+            if log is not None:
+                log.info(prefix + line)
+
+            if errorPattern.search(line):
+                result['errorCount'] += 1
+                if len(result['errors']) < maxBuildErrors:
+                    result['errors'].append(line)
+            elif warningPattern.search(line):
+                result['warningCount'] += 1
+            elif projectPattern.search(line):
+                result['projects'] += 1
+            else:
+                action = actionPattern.match(line)
+                if action is not None:
+                    result['actions'] = int(action.group(2))
+    result['returncode'] = process.wait()
+    result['seconds'] = time.perf_counter() - start
+    if running is not None:
+        with running['lock']:
+            running['processes'].remove(process)
+    if ownLog:
+        closeBuildLog(log)
+
+    # Repeat the errors at the end, where they are easy to find
+    print(f"\n{label} finished in {result['seconds']:.1f}s with exit code {result['returncode']}: "
+          f"{result['errorCount']} error{'s' if result['errorCount'] != 1 else ''}, "
+          f"{result['warningCount']} warning{'s' if result['warningCount'] != 1 else ''}"
+          f"{', ' + str(result['projects']) + ' projects' if result['projects'] else ''}"
+          f"{', ' + str(result['actions']) + ' actions' if result['actions'] else ''}.")
+    for error in result['errors']:
+        print('    ' + error.strip())
+    if result['errorCount'] > len(result['errors']):
+        print(f"    ...and {result['errorCount'] - len(result['errors'])} more")
+    return result
+
+
+def closeBuildLog(log):
+    "Close the build log file, if there is one"
+
+    if log is None:
+        return
+    for handler in log.handlers[:]:
+        handler.close()
+        log.removeHandler(handler)
+
+
+def openBuildLog(file):
+    "Returns a logger that writes to a rotating log file, or None if build logging is off"
+
+    if not file:
+        return None
+    import logging
+    import logging.handlers
+    log = logging.getLogger('UnrealCleanupTool.build')
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    handler = logging.handlers.RotatingFileHandler(file, maxBytes=buildLogMaxBytes, backupCount=buildLogBackups, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    # Each run starts a new file
+    if os.path.exists(file) and os.path.getsize(file) > 0:
+        handler.doRollover()
+    log.addHandler(handler)
+    return log
+
+def findDevenv():
+    "Returns the path of the visual studio executable"
+
+    # Check if we have it saved first
+    path = lookupTool('VisualStudio', "devenv.exe")
+    if path is not None:
+        return path
+
+    if appdataSavedVars.get("devenvPath") is not None:
+        if os.path.exists(appdataSavedVars["devenvPath"]):
+            return appdataSavedVars["devenvPath"]
+
+    if os.path.exists(visualStudioRoot):
+        vsPath = findHighestVersion(visualStudioRoot)
+        if vsPath:
+            # Search every edition (Community, Professional...) at once
+            editions = [entry.path for entry in os.scandir(vsPath) if entry.is_dir()]
+            path = searchFiles(editions, lambda name: name.lower() == "devenv.exe", "devenv.exe")
+            if path is not None:
+                edition = next(e for e in editions if os.path.commonpath([e, path]) == e)
+                addToIndex('VisualStudio', edition, "devenv.exe", path)
+                saveData()
+                return path
+
+    print("Could not find Visual Studio install directory. Please use -vsdir to select the directory.")
+    return None
+
+
+def findHighestVersion(root):
+    "Returns the path to the folder with the higest number in the name"
+
+    highest_version = 0
+    highest_version_folder = ""
+
+    for entry in os.scandir(root):
+        if entry.is_dir():
+            try:
+                version_number = int(entry.name)
+                if version_number > highest_version:
+                    highest_version = version_number
+                    highest_version_folder = entry.path
+            except ValueError:
+                continue
+
+    return highest_version_folder
+
+
+# if it works it ain't stupid
+def checkgpf():
+    "Check if we can generate project files"
+
+    path, message = locateUnrealBuildTool()
+    return {'success': path is not None, 'message': message}
+
+
+def runClean(targets=None):
+    "Delete, then generate project files and compile if enabled"
+
+    # Check if we are in an unreal directory
+    if checkDirectory() == False: return
+
+    if config['settings']['generateProjectFiles'] != True:
+        result = delete(targets)
+        recordRun(not result['skipped'])
+        return
+
+    # Project files only need their own outputs gone, the rest is deleted while they are generated
+    leftovers = openJournal()
+    trim = targets is None
+    if trim:
+        targets = projectTargets()
+    targets = resumeTargets(leftovers, targets)
+    buildTargets = []
+    otherTargets = []
+    for target in targets:
+        (buildTargets if isProjectFileOutput(target) else otherTargets).append(target)
+    if trim:
+        otherTargets = trimTargets(otherTargets)
+
+    results = []
+    steps = [
+        {'name': 'delete project files', 'run': lambda: results.append(deleteTargets(buildTargets))},
+        {'name': 'delete other', 'run': lambda: results.append(deleteTargets(otherTargets)), 'background': True},
+        {'name': 'report', 'run': lambda: not finishDelete(results)['skipped'], 'after': ['delete project files', 'delete other']},
+        {'name': 'generateProjectFiles', 'run': generateProjectFiles, 'after': ['delete project files']}
+    ]
+    # We do an extra check in case the user modified the json file
+    if config['settings']['compile'] == True:
+        # Everything has to be gone before building, the report fails if something was locked
+        steps.append({'name': 'compile', 'run': compile, 'after': ['generateProjectFiles', 'report']})
+
+    recordRun(runSteps(steps))
+
+
+def isProjectFileOutput(target):
+    "Check if generating project files writes to a target, so it has to be deleted first"
+
+    key = normRule(target['path'])
+    return (key.split('/')[0] in {normRule(folder) for folder in projectFileOutputs}
+            or key.endswith(projectFileExtensions))
+
+
+def runSteps(steps):
+    "Run each step once the steps it comes after are done. Background steps run on their own thread, the rest on this one so prompts stay on it. When a step returns False, the steps that come after it are not run"
+
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    pending = list(steps)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, sum(1 for step in steps if step.get('background')))) as pool:
+        while pending or running:
+            ready = [step for step in pending if all(name in done for name in step.get('after', []))]
+            for step in ready:
+                if step.get('background'):
+                    pending.remove(step)
+                    running[pool.submit(runStep, step)] = step['name']
+
+            step = next((step for step in ready if not step.get('background')), None)
+            if step is not None:
+                pending.remove(step)
+                if runStep(step) == False:
+                    cancelSteps(pending, step['name'])
+                else:
+                    done.add(step['name'])
+                continue
+
+            # Nothing to do here until a background step finishes
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # Raises what the step raised, after the other steps are done
+                if future.result() == False:
+                    cancelSteps(pending, name)
+                else:
+                    done.add(name)
+
+    return not pending and len(done) == len(steps)
+
+
+def cancelSteps(pending, failed):
+    "Remove the steps that come after a failed step, directly or through other steps, from pending"
+
+    failed = {failed}
+    cancelled = True
+    while cancelled:
+        cancelled = [step for step in pending if failed.intersection(step.get('after', []))]
+        for step in cancelled:
+            pending.remove(step)
+            failed.add(step['name'])
+
+
+def runStep(step):
+    "Run and time a single step"
+
+    with phase(step['name']):
+        return step['run']()
+
+
+def historyFile():
+    "Returns the path of the run history database"
+
+    return os.path.join(appdataSavedVarsPath, "UnrealCleanupTool", "history.db")
+
+
+def openHistory():
+    "Open the run history database, creating it if needed"
+
+    import sqlite3
+    folder = os.path.dirname(historyFile())
+    if not exists(folder):
+        os.makedirs(folder)
+    connection = sqlite3.connect(historyFile(), timeout=10)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started REAL, project TEXT, engine TEXT, success INTEGER,
+                                         seconds REAL, deleteSeconds REAL, generateSeconds REAL, compileSeconds REAL,
+                                         files INTEGER, bytes INTEGER);
+        CREATE TABLE IF NOT EXISTS phases (run INTEGER, name TEXT, seconds REAL);
+        CREATE TABLE IF NOT EXISTS rules (run INTEGER, rule TEXT, pattern TEXT, seconds REAL, files INTEGER, bytes INTEGER);
+        CREATE INDEX IF NOT EXISTS runsByProject ON runs (project, started);
+        CREATE INDEX IF NOT EXISTS rulesByRun ON rules (run);
+    ''')
+    return connection
+
+
+def recordRun(success):
+    "Save the timings of this clean, and what each rule freed, to the run history"
+
+    if tracer is None:
+        return
+    phases = {}
+    rules = {}
+    deletes = []
+    for event in tracer['events']:
+        seconds = event['end'] - event['start']
+        if event['category'] == 'rule':
+            rule, _, pattern = event['name'].partition(': ')
+            row = rules.setdefault((rule, pattern), [0.0, 0, 0])
+            row[0] += seconds
+            row[1] += event['counters'].get('files', 0)
+            row[2] += event['counters'].get('bytes', 0)
+        else:
+            phases[event['name']] = phases.get(event['name'], 0.0) + seconds
+            if event['name'] == 'delete':
+                deletes.append(event)
+
+    # Deletes can run side by side, so this is the time from the first start to the last end
+    deleteSeconds = max(e['end'] for e in deletes) - min(e['start'] for e in deletes) if deletes else 0.0
+    import sqlite3
+    try:
+        connection = openHistory()
+        with connection:
+            cursor = connection.execute('INSERT INTO runs (started, project, engine, success, seconds, deleteSeconds, generateSeconds, compileSeconds, files, bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        (time.time() - (time.perf_counter() - tracer['start']), os.path.abspath('.'), uprojectData.get('EngineAssociation', ''),
+                                         int(bool(success)), time.perf_counter() - tracer['start'], deleteSeconds, phases.get('generateProjectFiles', 0.0),
+                                         phases.get('compile', 0.0), sum(row[1] for row in rules.values()), sum(row[2] for row in rules.values())))
+            run = cursor.lastrowid
+            connection.executemany('INSERT INTO phases VALUES (?, ?, ?)', [(run, name, seconds) for name, seconds in phases.items()])
+            connection.executemany('INSERT INTO rules VALUES (?, ?, ?, ?, ?, ?)', [(run, rule, pattern, *row) for (rule, pattern), row in rules.items()])
+        connection.close()
+    except sqlite3.Error as e:
+        print(f'Could not save the run history: {e}')
+
+
+def showHistory(count):
+    "Print the latest runs of this project, how the times are trending and what each rule costs in rebuild time"
+
+    if not exists(historyFile()):
+        print("No runs recorded yet.")
+        return
+    import sqlite3
+    try:
+        connection = openHistory()
+    except sqlite3.Error as e:
+        print(f'Could not read the run history: {e}')
+        return
+
+    # Only this project when run in one
+    project = os.path.abspath('.') if uprojectPath is not None else None
+    where = 'WHERE project = ?' if project else ''
+    parameters = (project,) if project else ()
+    runs = connection.execute(f'SELECT id, started, engine, success, seconds, deleteSeconds, generateSeconds, compileSeconds, bytes FROM runs {where} ORDER BY started DESC', parameters).fetchall()
+    if not runs:
+        print("No runs recorded for this project yet.")
+        connection.close()
+        return
+
+    print(f'{"Date":<18}{"Engine":<10}{"Total":>9}{"Delete":>9}{"Generate":>10}{"Compile":>9}{"Freed":>12}')
+    for run, started, engine, success, seconds, deleteSeconds, generateSeconds, compileSeconds, size in reversed(runs[:count]):
+        date = time.strftime('%Y-%m-%d %H:%M', time.localtime(started))
+        print(f'{date:<18}{engine or "-":<10}{seconds:>8.1f}s{deleteSeconds:>8.1f}s{generateSeconds:>9.1f}s{compileSeconds:>8.1f}s'
+              f'{formatSize(size):>12}{"" if success else "  failed"}')
+
+    # Latest runs against the ones before them
+    latest, earlier = runs[:count], runs[count:count * 2]
+    if earlier:
+        print()
+        for label, column in [('Total', 4), ('Delete', 5), ('Generate', 6), ('Compile', 7)]:
+            now = sum(r[column] for r in latest) / len(latest)
+            before = sum(r[column] for r in earlier) / len(earlier)
+            change = f'{(now - before) / before * 100:+.0f}%' if before > 0 else 'n/a'
+            print(f'{label:<10}{now:>8.1f}s on average, {change} from the {len(earlier)} runs before')
+
+    # Rebuild time per GB: how long the compiles after a rule freed something took, compared to compiles where it didn't
+    compiled = {r[0]: r[7] for r in runs if r[7] > 0 and r[3]}
+    freed = {}
+    for run, rule, pattern, size in connection.execute(f'SELECT run, rule, pattern, bytes FROM rules WHERE run IN (SELECT id FROM runs {where})', parameters):
+        freed.setdefault((rule, pattern), {})[run] = freed.get((rule, pattern), {}).get(run, 0) + size
+    connection.close()
+
+    rows = []
+    for (rule, pattern), sizes in freed.items():
+        withRule = [compiled[run] for run, size in sizes.items() if size > 0 and run in compiled]
+        without = [seconds for run, seconds in compiled.items() if sizes.get(run, 0) == 0]
+        average = sum(sizes.values()) / len(sizes)
+        rebuild = sum(withRule) / len(withRule) - (sum(without) / len(without) if without else 0.0) if withRule else None
+        perGB = rebuild / (average / 1024 ** 3) if rebuild is not None and average > 0 else None
+        rows.append((perGB if perGB is not None else -1.0, f'{rule}: {pattern}', len(sizes), average, rebuild))
+
+    print(f'\n{"Rule":<44}{"Runs":>6}{"Avg freed":>12}{"Rebuild":>10}{"s/GB":>10}')
+    for perGB, name, runCount, average, rebuild in sorted(rows, reverse=True):
+        print(f'{name:<44}{runCount:>6}{formatSize(average):>12}'
+              f'{f"{rebuild:.1f}s" if rebuild is not None else "-":>10}{f"{perGB:.0f}" if perGB >= 0 else "-":>10}')
+    if not compiled:
+        print("Rebuild times are shown once runs with automatic compilation are recorded.")
+
+
+def phase(name, category='phase'):
+    "Time a block of code if tracing is on. The block gets a dict it can count files and bytes in"
+
+    # Costs next to nothing when tracing is off
+    if tracer is None:
+        return nullcontext({})
+    return tracePhase(name, category)
+
+
+@contextmanager
+def tracePhase(name, category):
+    "Record the wall time and counters of a block of code"
+
+    counters = {}
+    start = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        end = time.perf_counter()
+        with tracer['lock']:
+            tracer['events'].append({'name': name, 'category': category, 'start': start, 'end': end,
+                                     'thread': threading.get_ident(), 'counters': counters})
+
+
+def countPhase(counters, files, size):
+    "Add deleted files and bytes to a phase's counters"
+
+    counters['files'] = counters.get('files', 0) + files
+    counters['bytes'] = counters.get('bytes', 0) + size
+
+
+def startTracing(profile):
+    "Start recording phase timings, and profiling if requested"
+
+    global tracer
+    tracer = {'start': time.perf_counter(), 'events': [], 'lock': threading.Lock(), 'profiler': None}
+    if profile:
+        import cProfile
+        tracer['profiler'] = cProfile.Profile()
+        tracer['profiler'].enable()
+
+
+def stopTracing(traceFile, profileFile):
+    "Print the phase timings and save the trace and profile files"
+
+    global tracer
+    if tracer['profiler'] is not None:
+        tracer['profiler'].disable()
+        tracer['profiler'].dump_stats(profileFile)
+        print(f'Profile saved to {profileFile}')
+
+    # Sum up repeated phases, keeping the order they first started in
+    tracer['events'].sort(key=lambda event: event['start'])
+    summary = {}
+    for event in tracer['events']:
+        row = summary.setdefault((event['category'], event['name']), [0, 0.0, 0, 0])
+        row[0] += 1
+        row[1] += event['end'] - event['start']
+        row[2] += event['counters'].get('files', 0)
+        row[3] += event['counters'].get('bytes', 0)
+
+    print(f'\n{"Phase":<50}{"Runs":>6}{"Time":>11}{"Files":>10}{"Freed":>12}')
+    for (category, name), (runs, seconds, files, size) in summary.items():
+        label = name if category == 'phase' else '    ' + name
+        print(f'{label:<50}{runs:>6}{seconds:>10.3f}s{files:>10}{formatSize(size):>12}')
+    print(f'{"Total":<50}{"":>6}{time.perf_counter() - tracer["start"]:>10.3f}s')
+
+    if traceFile:
+        events = []
+        for event in tracer['events']:
+            events.append({'name': event['name'], 'cat': event['category'], 'ph': 'X', 'pid': os.getpid(), 'tid': event['thread'],
+                           'ts': (event['start'] - tracer['start']) * 1e6, 'dur': (event['end'] - event['start']) * 1e6,
+                           'args': event['counters']})
+        with open(traceFile, 'w') as outfile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, outfile)
+        print(f'Trace saved to {traceFile}')
+
+    tracer = None
+
+
+def main():
+    args = initArgs() if checkArgs() else None
+    tracing = args is not None and (args.trace or args.tracefile is not None or args.profile is not None)
+    # Always timed for the run history, only printed when asked for
+    startTracing(args.profile if tracing else None)
+
+    try:
+        with phase('loadData'):
+            loadData()
+
+        # Tracing on its own traces a normal clean
+        if args is None or (tracing and not hasActions(args)):
+            runClean()
+        else:
+            processArgs(args)
+    finally:
+        if tracing:
+            stopTracing(args.tracefile, args.profile)
+
+
+def hasActions(args):
+    "Check if any arguments other than the tracing ones were given"
+
+    return any(value not in (None, False) for key, value in vars(args).items() if key not in ('trace', 'tracefile', 'profile'))
 
-        if config['settings']['generateProjectFiles'] == True:
-            if generateProjectFiles() == False: return
-            
-        # We do an extra check in case the user modified the json file
-        if config['settings']['compile'] == True and config['settings']['generateProjectFiles'] == True:
-            if compile() == False: return
-          
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,324 @@
+# Unreal Cleanup Tool benchmarks
+# Generates synthetic unreal projects and engine installs in a temporary directory and times the hot paths of UCT.py.
+# Runs on any OS, the Windows-only parts of UCT.py are replaced with stand-ins.
+# Results can be saved as JSON to compare commits.
+# Use 'benchmark.py -h' for available options.
+
+import argparse
+import importlib
+import subprocess
+import platform
+import shutil
+import tempfile
+import types
+import json
+import copy
+import time
+import sys
+import os
+
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+
+# Benchmarks that can be run, in order
+benchmarkNames = ['startup', 'delete', 'removeTree', 'findFile', 'findExtension', 'loadData']
+
+# Longest a run of UCT.py may take to start, in seconds, including the interpreter
+startupBudget = 0.050
+
+
+def makeWinregStandIn():
+    "A winreg module that behaves like a machine with no engines installed"
+
+    winreg = types.ModuleType('winreg')
+    winreg.HKEY_LOCAL_MACHINE = 0x80000002
+    winreg.HKEY_CURRENT_USER = 0x80000001
+    winreg.KEY_READ = 0x20019
+
+    def openKey(*args):
+        raise FileNotFoundError('Stand-in registry has no keys')
+
+    winreg.OpenKey = openKey
+    winreg.CloseKey = lambda key: None
+    return winreg
+
+
+def loadUct():
+    "Import UCT.py with stand-ins for the Windows-only parts"
+
+    if 'winreg' not in sys.modules:
+        try:
+            import winreg
+        except ImportError:
+            sys.modules['winreg'] = makeWinregStandIn()
+    os.environ.setdefault('LOCALAPPDATA', tempfile.gettempdir())
+    if scriptDir not in sys.path:
+        sys.path.insert(0, scriptDir)
+    uct = importlib.import_module('UCT')
+
+    # No attrib calls, popups or background processes while timing
+    uct.hideFile = lambda file: None
+    uct.startReaper = uct.reapStaging
+    uct.headless = True
+    uct.config = copy.deepcopy(uct.defaultConfig)
+    return uct
+
+
+def makeTree(root, files, filesPerFolder=50, foldersPerFolder=4, size=0):
+    "Create a folder tree with the given number of files"
+
+    data = b'x' * size
+    folders = [root]
+    created = 0
+    while created < files:
+        folder = folders.pop(0)
+        os.makedirs(folder, exist_ok=True)
+        for i in range(min(filesPerFolder, files - created)):
+            with open(os.path.join(folder, f'file{i}.obj'), 'wb') as f:
+                f.write(data)
+        created += min(filesPerFolder, files - created)
+        folders.extend(os.path.join(folder, f'sub{i}') for i in range(foldersPerFolder))
+
+
+def makeProject(root, files, filesPerFolder=50, foldersPerFolder=4, size=0):
+    "Create an unreal project, with most of the files in the temporary folders"
+
+    layout = [
+        ('Binaries/Win64', 0.05),
+        ('Intermediate/Build/Win64', 0.35),
+        ('DerivedDataCache', 0.25),
+        ('.vs', 0.05),
+        ('Content', 0.15),
+        ('Source', 0.05),
+        ('Plugins/Example/Binaries/Win64', 0.03),
+        ('Plugins/Example/Intermediate', 0.07)
+    ]
+    for folder, share in layout:
+        makeTree(os.path.join(root, folder), max(1, int(files * share)), filesPerFolder, foldersPerFolder, size)
+
+    with open(os.path.join(root, 'Example.uproject'), 'w') as f:
+        json.dump({'FileVersion': 3, 'EngineAssociation': '5.3', 'Modules': [{'Name': 'Example', 'Type': 'Runtime'}]}, f)
+    open(os.path.join(root, 'Example.sln'), 'w').close()
+
+
+def makeEngine(root, files, filesPerFolder=50, foldersPerFolder=4, size=0):
+    "Create an engine install with most files in the folders a search should skip"
+
+    # Roughly how a real install is spread out
+    for folder, share in [('Content', 0.3), ('Source', 0.2), ('Plugins', 0.2), ('Shaders', 0.05), ('Intermediate', 0.05),
+                          ('Binaries/ThirdParty', 0.15), ('Binaries/Win64', 0.05)]:
+        makeTree(os.path.join(root, 'Engine', folder), max(1, int(files * share)), filesPerFolder, foldersPerFolder, size)
+    ubt = os.path.join(root, 'Engine', 'Binaries', 'DotNET', 'UnrealBuildTool', 'UnrealBuildTool.exe')
+    os.makedirs(os.path.dirname(ubt))
+    open(ubt, 'wb').close()
+    return ubt
+
+
+def legacyFindFile(root, filename, binariesLast=False):
+    "findFile as it was before the pruned search, for comparison"
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        # The order os.walk visits folders in depends on the file system, this is the worst case
+        if binariesLast:
+            dirnames.sort(key=lambda name: name == 'Binaries')
+        if filename in filenames:
+            return os.path.abspath(os.path.join(dirpath, filename))
+    return None
+
+
+def timeIt(func, *args, repeat=1, setup=None):
+    "Returns the best wall time of a function call in seconds. Setup runs before each call and is not timed"
+
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def benchStartup(uct, workdir, args):
+    "Time how long UCT.py takes to start compared to the bare interpreter, and show the slowest imports"
+
+    env = dict(os.environ)
+    env.setdefault('LOCALAPPDATA', tempfile.gettempdir())
+    # Measure with cached bytecode, like every run after the first one
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    def run(code):
+        subprocess.run([sys.executable, '-c', code], cwd=scriptDir, env=env, check=True)
+
+    run('import UCT')
+    repeat = max(args.repeat, 10)
+    results = {
+        'interpreter': timeIt(run, 'pass', repeat=repeat),
+        'import UCT': timeIt(run, 'import UCT', repeat=repeat)
+    }
+
+    # Import-time profile, lines look like 'import time: self [us] | cumulative | name'
+    profile = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import UCT'], cwd=scriptDir, env=env, capture_output=True, text=True).stderr
+    imports = []
+    for line in profile.splitlines()[1:]:
+        parts = line.split('|')
+        if len(parts) == 3 and parts[0].split(':')[-1].strip().isdigit():
+            imports.append((int(parts[0].split(':')[-1]), parts[2].strip()))
+    print('    slowest imports:')
+    for microseconds, module in sorted(imports, reverse=True)[:5]:
+        print(f'        {module:<24}{microseconds / 1000:8.2f} ms')
+
+    verdict = 'within' if results['import UCT'] <= startupBudget else 'OVER'
+    print(f"    startup is {verdict} the {startupBudget * 1000:.0f} ms budget")
+    return results
+
+
+def benchDelete(uct, workdir, args):
+    "Clean a whole synthetic project with delete()"
+
+    project = os.path.join(workdir, 'Project')
+    cwd = os.getcwd()
+    try:
+        def setup():
+            shutil.rmtree(project, ignore_errors=True)
+            makeProject(project, args.files, args.perfolder, args.fanout, args.size)
+            os.chdir(project)
+            uct.path = project
+            uct.config = copy.deepcopy(uct.defaultConfig)
+        return {'delete': timeIt(uct.delete, repeat=args.repeat, setup=setup)}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(project, ignore_errors=True)
+
+
+def benchRemoveTree(uct, workdir, args):
+    "Compare shutil.rmtree with the parallel deletion engine"
+
+    tree = os.path.join(workdir, 'Intermediate')
+    setup = lambda: makeTree(tree, args.files, args.perfolder, args.fanout, args.size)
+    return {
+        'shutil.rmtree': timeIt(shutil.rmtree, tree, repeat=args.repeat, setup=setup),
+        'removeTree': timeIt(uct.removeTree, tree, uct.getDeleteWorkers(), repeat=args.repeat, setup=setup)
+    }
+
+
+def benchFindFile(uct, workdir, args):
+    "Compare the old os.walk search for UnrealBuildTool with the pruned search"
+
+    root = os.path.join(workdir, 'UE_5.3')
+    ubt = makeEngine(root, args.files, args.perfolder, args.fanout, args.size)
+    results = {}
+    try:
+        known = uct.knownToolLocations.pop('UnrealBuildTool.exe')
+        try:
+            worstCase = lambda root, filename: legacyFindFile(root, filename, True)
+            for name, func in [('os.walk', legacyFindFile), ('os.walk worst', worstCase), ('pruned search', uct.findFile)]:
+                if func(root, 'UnrealBuildTool.exe') != ubt:
+                    raise RuntimeError(f'{name} did not find UnrealBuildTool.exe')
+                results[name] = timeIt(func, root, 'UnrealBuildTool.exe', repeat=args.repeat)
+        finally:
+            uct.knownToolLocations['UnrealBuildTool.exe'] = known
+        results['known location'] = timeIt(uct.findFile, root, 'UnrealBuildTool.exe', repeat=args.repeat)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def benchFindExtension(uct, workdir, args):
+    "Find the .sln file in a synthetic project"
+
+    project = os.path.join(workdir, 'Project')
+    makeProject(project, args.files, args.perfolder, args.fanout, args.size)
+    try:
+        if uct.findExtension(project, '.sln') is None:
+            raise RuntimeError('findExtension did not find the .sln file')
+        return {'findExtension': timeIt(uct.findExtension, project, '.sln', repeat=args.repeat)}
+    finally:
+        shutil.rmtree(project, ignore_errors=True)
+
+
+def benchLoadData(uct, workdir, args):
+    "Load the config, saved data and uproject file of a project"
+
+    project = os.path.join(workdir, 'Project')
+    makeProject(project, args.files, args.perfolder, args.fanout, args.size)
+    cwd = os.getcwd()
+    try:
+        os.chdir(project)
+        uct.appdataSavedVarsPath = os.path.join(workdir, 'LocalAppData')
+        os.makedirs(uct.appdataSavedVarsPath, exist_ok=True)
+        uct.config = copy.deepcopy(uct.defaultConfig)
+        uct.appdataSavedVars = copy.deepcopy(uct.defaultAppdataSavedVars)
+        uct.saveData()
+        return {'loadData': timeIt(uct.loadData, repeat=max(args.repeat, 10))}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(project, ignore_errors=True)
+
+
+benchmarks = {
+    'startup': benchStartup,
+    'delete': benchDelete,
+    'removeTree': benchRemoveTree,
+    'findFile': benchFindFile,
+    'findExtension': benchFindExtension,
+    'loadData': benchLoadData
+}
+
+
+def gitCommit():
+    "Returns the current commit of the repository, if there is one"
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=scriptDir, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Unreal Cleanup Tool')
+    parser.add_argument('-run', help='Benchmarks to run', nargs='+', choices=benchmarkNames, default=benchmarkNames)
+    parser.add_argument('-files', help='Number of files in each synthetic tree', type=int, default=200000)
+    parser.add_argument('-perfolder', help='Number of files in each folder', type=int, default=50)
+    parser.add_argument('-fanout', help='Number of subfolders in each folder, lower makes deeper trees', type=int, default=4)
+    parser.add_argument('-size', help='Size of each file in bytes', type=int, default=0)
+    parser.add_argument('-repeat', help='Number of times to run each benchmark, the best time is kept', type=int, default=1)
+    parser.add_argument('-workers', help='Number of delete threads (0 = automatic)', type=int, default=0)
+    parser.add_argument('-dir', help='Folder to create the synthetic trees in', type=str, default=None)
+    parser.add_argument('-json', help='Save the results to a JSON file', type=str, metavar='[file]')
+    args = parser.parse_args()
+
+    uct = loadUct()
+    uct.defaultConfig['settings']['deleteWorkers'] = args.workers
+    uct.config = copy.deepcopy(uct.defaultConfig)
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='uct-bench-', dir=args.dir)
+    try:
+        for name in benchmarkNames:
+            if name not in args.run:
+                continue
+            print(f'{name}:')
+            results[name] = benchmarks[name](uct, workdir, args)
+            for label, seconds in results[name].items():
+                print(f'    {label:<16}{seconds * 1000:10.2f} ms')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        report = {
+            'commit': gitCommit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('json', 'dir', 'run')},
+            'results': results
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Results saved to {args.json}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# Stand-in for devenv.exe, for testing UCT.py builds on any OS.
+# Called like devenv: fakebuild.py [solution] /Build [configuration]. What it does depends on the configuration name:
+#   Fail... prints errors and exits with 1
+#   Slow... prints progress for a minute, until it is stopped
+#   anything else prints projects, progress and warnings and exits with 0
+
+import time
+import sys
+
+configuration = sys.argv[-1]
+
+
+def say(line):
+    print(line, flush=True)
+
+
+if configuration.startswith('Fail'):
+    say(f'1>------ Build started: Project: Example, Configuration: {configuration} ------')
+    say('[1/2] Compile Example.cpp')
+    say("Example.cpp(12): error C2065: 'Missing': undeclared identifier")
+    say('Example.cpp(20): warning C4996: deprecated call')
+    say('ERROR: UnrealBuildTool failed')
+    sys.exit(1)
+
+if configuration.startswith('Slow'):
+    say(f'1>------ Build started: Project: Example, Configuration: {configuration} ------')
+    for i in range(600):
+        say(f'[{i + 1}/600] Compile Module{i}.cpp')
+        time.sleep(0.1)
+    sys.exit(0)
+
+say(f'1>------ Build started: Project: Example, Configuration: {configuration} ------')
+say(f'2>------ Build started: Project: UE5, Configuration: {configuration} ------')
+say('[1/3] Compile Example.cpp')
+say('Example.cpp(20): warning C4996: deprecated call')
+say('[2/3] Compile Other.cpp')
+say('Warning: Module Other has no source files')
+say('[3/3] Link UnrealEditor-Example.dll')
+say('========== Build: 2 succeeded, 0 failed ==========')
@@ -0,0 +1,57 @@
+# Tests for running builds, with fakebuild.py standing in for devenv
+
+import copy
+import time
+import sys
+import os
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testDir))
+from benchmark import loadUct
+
+uct = loadUct()
+fakeBuild = os.path.join(testDir, 'fakebuild.py')
+
+
+def setup_function():
+    uct.config = copy.deepcopy(uct.defaultConfig)
+
+
+def test_runBuild_counts():
+    result = uct.runBuild([sys.executable, fakeBuild, 'Example.sln', '/Build', 'Development Editor|Win64'], 'Development Editor|Win64')
+    assert result['returncode'] == 0
+    assert result['errorCount'] == 0
+    assert result['warningCount'] == 2
+    assert result['projects'] == 2
+    assert result['actions'] == 3
+    assert result['lines'] == 8
+
+
+def test_runBuild_errors():
+    result = uct.runBuild([sys.executable, fakeBuild, 'Example.sln', '/Build', 'Fail|Win64'], 'Fail|Win64')
+    assert result['returncode'] == 1
+    assert result['errorCount'] == 2
+    assert result['errors'] == ["Example.cpp(12): error C2065: 'Missing': undeclared identifier", 'ERROR: UnrealBuildTool failed']
+    assert result['warningCount'] == 1
+    assert result['projects'] == 1
+
+
+def test_runBuild_missing_tool():
+    result = uct.runBuild([os.path.join(testDir, 'missing.exe')], 'Missing')
+    assert result['returncode'] is None
+
+
+def test_compileMatrix_builds_every_configuration():
+    uct.config['settings']['buildJobs'] = 2
+    results = uct.compileMatrix(sys.executable, fakeBuild, ['Development Editor|Win64', 'Shipping|Win64'])
+    assert [result['status'] for result in results] == ['ok', 'ok']
+
+
+def test_compileMatrix_first_failure_cancels_the_rest():
+    uct.config['settings']['buildJobs'] = 2
+    start = time.perf_counter()
+    # The slow build runs next to the failing one, the last one hasn't started when it fails
+    results = uct.compileMatrix(sys.executable, fakeBuild, ['Fail|Win64', 'Slow|Win64', 'Development Editor|Win64'])
+    assert [result['status'] for result in results] == ['failed', 'cancelled', 'cancelled']
+    # The slow build takes a minute when it isn't stopped
+    assert time.perf_counter() - start < 30
@@ -0,0 +1,107 @@
+# Tests for deleting with locked files and finishing interrupted cleans. Read-only folders stand in for files
+# that are in use, root can delete in those anyway so that test only runs as a normal user
+
+import tempfile
+import json
+import shutil
+import copy
+import stat
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import loadUct
+
+uct = loadUct()
+
+
+def makeFile(file):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'wb') as f:
+        f.write(b'x' * 100)
+
+
+def test_read_only_folder_is_skipped_and_resumed():
+    if os.name == 'nt' or os.geteuid() == 0:
+        import pytest
+        pytest.skip('needs a non-root user on a POSIX system')
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    locked = os.path.join('Binaries', 'Win64')
+    try:
+        os.chdir(root)
+        open('Example.uproject', 'w').close()
+        makeFile(os.path.join(locked, 'Example.dll'))
+        makeFile(os.path.join('Intermediate', 'Build', 'Example.obj'))
+        os.chmod(locked, stat.S_IRUSR | stat.S_IXUSR)
+        uct.config = copy.deepcopy(uct.defaultConfig)
+        uct.deleteRetryDelays = (0.0,)
+
+        # The rest is deleted, the locked file is skipped and kept in the journal
+        result = uct.delete()
+        assert result['skipped'] == [os.path.join(locked, 'Example.dll')]
+        assert not os.path.exists('Intermediate')
+        assert os.path.exists(os.path.join(locked, 'Example.dll'))
+        leftovers, planned = uct.readJournal()
+        assert [target['path'] for target in leftovers] == [os.path.join(locked, 'Example.dll')]
+
+        # Once it is unlocked the next run finishes it
+        os.chmod(locked, stat.S_IRWXU)
+        result = uct.delete()
+        assert result['skipped'] == []
+        assert not os.path.exists('Binaries')
+        assert not os.path.exists(uct.journalFileName)
+    finally:
+        os.chdir(cwd)
+        if os.path.isdir(os.path.join(root, locked)):
+            os.chmod(os.path.join(root, locked), stat.S_IRWXU)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+
+def test_leftovers_of_rules_no_longer_used_are_dropped():
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(root)
+        open('Example.uproject', 'w').close()
+        makeFile(os.path.join('DerivedDataCache', 'Cache.ddp'))
+        makeFile(os.path.join('Binaries', 'Example.dll'))
+        # A clean was stopped while deleting DerivedDataCache, since then it is kept within a budget
+        with open(uct.journalFileName, 'w') as f:
+            f.write(json.dumps({'journal': 1, 'root': os.path.abspath('.')}) + '\n')
+            f.write(json.dumps({'plan': {'rule': 'folders', 'pattern': 'DerivedDataCache', 'path': 'DerivedDataCache', 'type': 'folder'}}) + '\n')
+            f.write(json.dumps({'plan': {'rule': 'skipped', 'pattern': 'Example.log', 'path': 'Example.log', 'type': 'file'}}) + '\n')
+        uct.config = copy.deepcopy(uct.defaultConfig)
+        uct.config['settings']['ddcBudget'] = 1024 ** 3
+
+        assert [target['rule'] for target in uct.activeLeftovers(uct.readJournal()[0])] == ['skipped']
+        uct.delete()
+        assert os.path.exists(os.path.join('DerivedDataCache', 'Cache.ddp'))
+        assert not os.path.exists('Binaries')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+
+def test_logs_are_only_compressed_when_smaller():
+    root = tempfile.mkdtemp()
+    try:
+        small = os.path.join(root, 'Small.log')
+        large = os.path.join(root, 'Large.log')
+        with open(small, 'w') as f:
+            f.write('hi')
+        with open(large, 'w') as f:
+            f.write('LogTemp: Display: the same line again\n' * 10000)
+        files, saved = uct.compressFiles([small, large], 2)
+        assert files == 1 and saved > 0
+        assert sorted(os.listdir(root)) == ['Large.log.gz', 'Small.log']
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    test_read_only_folder_is_skipped_and_resumed()
+    print('ok')
@@ -0,0 +1,56 @@
+# Tests for which files and folders the delete rules pick
+
+import tempfile
+import shutil
+import copy
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import loadUct
+
+uct = loadUct()
+
+
+def makeFiles(root, files):
+    for file in files:
+        path = os.path.join(root, *file.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+
+
+def walk(root, files=(), folders=(), extensions=()):
+    localconfig = copy.deepcopy(uct.defaultConfig['fileManagement'])
+    localconfig.update(files=list(files), folders=list(folders), extensions=list(extensions))
+    targets = uct.walkTargets(uct.compileRules(localconfig), root)
+    # Paths are relative to the root
+    return sorted(target['path'].replace(os.sep, '/') for target in targets)
+
+
+def test_rules_inside_skipped_folders():
+    root = tempfile.mkdtemp()
+    try:
+        makeFiles(root, ['Content/Developers/Me/Test.uasset', 'Content/Maps/Old.sln', 'Content/Maps/Old.umap',
+                         'ThirdParty/Lib/Build.log', 'Example.sln'])
+        # Named paths are found, extensions are not looked for inside Content and ThirdParty
+        assert walk(root, files=['ThirdParty/Lib/Build.log'], folders=['Content/Developers'], extensions=['.sln']) == \
+            ['Content/Developers', 'Example.sln', 'ThirdParty/Lib/Build.log']
+        assert walk(root, extensions=['.sln']) == ['Example.sln']
+    finally:
+        shutil.rmtree(root)
+
+
+def test_scopes_in_ue4_and_ue5_layouts():
+    root = tempfile.mkdtemp()
+    try:
+        # UE4 has no architecture folder, UE5 puts one between the platform and the target
+        for layout in ['UE4/Intermediate/Build/Win64/UnrealEditor', 'UE5/Intermediate/Build/Win64/x64/UnrealEditor']:
+            for configuration in ['Development', 'DebugGame']:
+                os.makedirs(os.path.join(root, *layout.split('/'), configuration))
+
+        for scope in ['Win64/UnrealEditor/Development', 'Win64/*/Development', '*/*/Development']:
+            for engine, target in [('UE4', 'Win64/UnrealEditor'), ('UE5', 'Win64/x64/UnrealEditor')]:
+                base = os.path.join(root, engine, 'Intermediate').replace(os.sep, '/')
+                assert list(uct.scopedFolders(base, [scope], uct.listFolders)) == [(scope, f'{base}/Build/{target}/Development')]
+    finally:
+        shutil.rmtree(root)
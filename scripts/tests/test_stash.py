@@ -0,0 +1,88 @@
+# Tests for stashing and restoring DerivedDataCache and Binaries
+
+import tempfile
+import shutil
+import copy
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import loadUct
+
+uct = loadUct()
+
+
+def makeFile(file, data):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'wb') as f:
+        f.write(data)
+
+
+def readFile(file):
+    with open(file, 'rb') as f:
+        return f.read()
+
+
+def inProject(test):
+    "Run a test in an empty project folder"
+
+    def run():
+        root = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            os.chdir(root)
+            open('Example.uproject', 'w').close()
+            uct.config = copy.deepcopy(uct.defaultConfig)
+            test()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+    run.__name__ = test.__name__
+    return run
+
+
+def stashExample():
+    "Stash a cache and binaries bigger than one chunk. Returns the archive and what was in it"
+
+    files = {os.path.join('DerivedDataCache', 'Cache.ddp'): os.urandom(uct.stashChunkSize + 1000),
+             os.path.join('Binaries', 'Win64', 'Example.dll'): b'dll' * 1000}
+    for file, data in files.items():
+        makeFile(file, data)
+    uct.stash('example')
+    assert not os.path.exists('DerivedDataCache')
+    return os.path.join(uct.stashFolderName, 'example.uctstash'), files
+
+
+@inProject
+def test_stash_and_restore():
+    archive, files = stashExample()
+    uct.restore('example')
+    for file, data in files.items():
+        assert readFile(file) == data
+
+
+@inProject
+def test_damaged_chunk_is_not_restored():
+    archive, files = stashExample()
+    data = bytearray(readFile(archive))
+    # A byte inside the compressed data of the first chunk
+    data[len(uct.stashMagic) + 12 + 1000] ^= 0xFF
+    makeFile(archive, bytes(data))
+
+    makeFile(os.path.join('Binaries', 'Current.dll'), b'current')
+    uct.restore('example')
+    # What is there now is left alone, and nothing half restored is left behind
+    assert readFile(os.path.join('Binaries', 'Current.dll')) == b'current'
+    assert not os.path.exists('DerivedDataCache')
+    assert not os.path.exists(os.path.join(uct.stashFolderName, 'restoring'))
+
+
+@inProject
+def test_cut_off_archive_is_not_restored():
+    archive, files = stashExample()
+    data = readFile(archive)
+    makeFile(archive, data[:len(data) // 2])
+
+    uct.restore('example')
+    assert not os.path.exists('DerivedDataCache')
+    assert not os.path.exists(os.path.join(uct.stashFolderName, 'restoring'))
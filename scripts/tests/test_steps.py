@@ -0,0 +1,35 @@
+# Tests for the step scheduler that runs a clean, project generation and compiling
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import loadUct
+
+uct = loadUct()
+
+
+def test_failed_step_cancels_only_what_comes_after_it():
+    ran = []
+
+    def step(name, result=None, after=(), background=False):
+        return {'name': name, 'run': lambda: ran.append(name) or result, 'after': list(after), 'background': background}
+
+    steps = [
+        step('delete project files'),
+        step('delete other', background=True),
+        step('report', after=['delete project files', 'delete other']),
+        step('generateProjectFiles', False, after=['delete project files']),
+        step('compile', after=['generateProjectFiles', 'report']),
+        step('upload', after=['compile'])
+    ]
+    assert uct.runSteps(steps) is False
+    assert sorted(ran) == ['delete other', 'delete project files', 'generateProjectFiles', 'report']
+
+
+def test_all_steps_run():
+    ran = []
+    steps = [{'name': name, 'run': lambda name=name: ran.append(name)} for name in ['a', 'b']]
+    steps[1]['after'] = ['a']
+    assert uct.runSteps(steps) is True
+    assert ran == ['a', 'b']